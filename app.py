@@ -3,22 +3,93 @@ Contract Playbook Builder - Main Flask Application
 
 A web application that generates professional contract playbooks from uploaded agreements.
 """
+import hashlib
+import json
 import os
+import tempfile
+import threading
+import time
 import uuid
-from datetime import datetime
-from flask import Flask, render_template, request, jsonify, send_file
+from cachetools import TTLCache
+from flask import Flask, Request, Response, render_template, request, jsonify, send_file
 from werkzeug.utils import secure_filename
 
 import config
-from utils.document_parser import parse_document, allowed_file
-from utils.playbook_generator import analyze_contract_chunked
-from utils.excel_writer import generate_playbook_excel
+from utils.document_parser import allowed_file, get_file_extension
+from utils.jobs import run_playbook, run_playbook_job, shared_upload_path
+from utils.llm_cache import CACHE_KEEP_FILES
+
+# Size of each read when copying a raw request body to disk
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+# Seconds between job status checks in the /api/stream event stream
+STATUS_STREAM_INTERVAL = 0.5
+
+# Each open stream holds a gunicorn thread, so streams end after this many
+# seconds and the browser's EventSource reconnects (after STATUS_STREAM_RETRY_MS)
+STATUS_STREAM_MAX_SECONDS = 25
+STATUS_STREAM_RETRY_MS = 1000
+
+
+class HashingUploadFile:
+    """
+    Temp file in the upload folder that SHA-256 hashes data as it is written.
+
+    The digest gives uploads a content-addressed name without a second pass
+    over the file.
+    """
+
+    def __init__(self):
+        self._file = tempfile.NamedTemporaryFile(
+            "wb+", dir=config.UPLOAD_FOLDER, suffix=".part", delete=False
+        )
+        self.sha256 = hashlib.sha256()
+
+    def write(self, data):
+        self.sha256.update(data)
+        return self._file.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+
+class StreamingRequest(Request):
+    """
+    Request class that spools uploaded files straight into the upload folder.
+
+    Werkzeug's default stream factory buffers uploads in memory (spilling to a
+    temp file only above 500KB). Writing each part directly to a file in
+    UPLOAD_FOLDER lets the upload endpoint move it into place with a rename
+    instead of copying it a second time.
+    """
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return HashingUploadFile()
+
 
 app = Flask(__name__)
+app.request_class = StreamingRequest
 app.config["MAX_CONTENT_LENGTH"] = config.MAX_FILE_SIZE_MB * 1024 * 1024
-
-# In-memory storage for progress tracking
-processing_status = {}
+app.config["USE_X_SENDFILE"] = config.USE_X_SENDFILE
+
+# In-memory storage for progress tracking (used when no job queue is configured).
+# Entries expire after JOB_RESULT_TTL so the store can't grow without bound.
+processing_status = TTLCache(maxsize=config.MAX_TRACKED_JOBS, ttl=config.JOB_RESULT_TTL)
+processing_status_lock = threading.Lock()
+
+# Redis-backed job queue; when configured, playbooks are generated by RQ workers
+job_queue = None
+if config.REDIS_URL:
+    from redis import Redis
+    from rq import Queue
+    from rq.job import Job
+    from rq.exceptions import NoSuchJobError
+
+    job_queue = Queue(
+        config.JOB_QUEUE_NAME,
+        connection=Redis.from_url(config.REDIS_URL),
+        default_timeout=config.JOB_TIMEOUT
+    )
 
 
 @app.route("/")
@@ -34,20 +105,31 @@ def upload_file():
 
     Returns JSON with job_id for progress tracking.
     """
-    if "file" not in request.files:
-        return jsonify({"error": "No file provided"}), 400
+    if request.mimetype == "multipart/form-data":
+        if "file" not in request.files:
+            return jsonify({"error": "No file provided"}), 400
+        file = request.files["file"]
+        original_filename = file.filename
+        options = request.form
+    else:
+        # Raw body upload, e.g. curl --data-binary @contract.pdf "/api/upload?filename=contract.pdf"
+        file = None
+        original_filename = request.args.get("filename", "")
+        options = request.args
 
-    file = request.files["file"]
-    if file.filename == "":
+    if original_filename == "":
+        _discard_upload(file)
         return jsonify({"error": "No file selected"}), 400
 
-    if not allowed_file(file.filename, config.ALLOWED_EXTENSIONS):
+    if not allowed_file(original_filename, config.ALLOWED_EXTENSIONS):
+        _discard_upload(file)
         return jsonify({
             "error": f"File type not supported. Allowed types: {', '.join(config.ALLOWED_EXTENSIONS)}"
         }), 400
 
     # Check for API key (Anthropic or OpenAI)
     if not config.ANTHROPIC_API_KEY and not config.OPENAI_API_KEY:
+        _discard_upload(file)
         return jsonify({
             "error": "API key not configured. Please set ANTHROPIC_API_KEY or OPENAI_API_KEY environment variable."
         }), 500
@@ -55,31 +137,52 @@ def upload_file():
     # Generate unique job ID
     job_id = str(uuid.uuid4())
 
-    # Save uploaded file
-    filename = secure_filename(file.filename)
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    saved_filename = f"{timestamp}_{job_id}_{filename}"
-    file_path = os.path.join(config.UPLOAD_FOLDER, saved_filename)
-    file.save(file_path)
+    # Multipart parts are already spooled into UPLOAD_FOLDER; raw bodies are
+    # copied there now
+    upload = file.stream if file is not None else _stream_to_file(request.stream)
+    upload.close()
 
-    # Get options from request
-    agreement_type = request.form.get("agreement_type", "General Agreement")
-    user_role = request.form.get("user_role", "Customer")
-    risk_tolerance = request.form.get("risk_tolerance", "Moderate")
+    # The extension comes from the original name (validated by allowed_file
+    # above): secure_filename strips non-ASCII names like "合同.docx" to "docx"
+    filename = secure_filename(original_filename)
+    file_path = _store_upload(upload, job_id, get_file_extension(original_filename))
 
-    # Initialize status
-    processing_status[job_id] = {
-        "status": "processing",
-        "progress": 0,
-        "message": "Uploading file...",
-        "file_path": file_path,
-        "original_filename": filename,
-        "agreement_type": agreement_type,
-        "user_role": user_role,
-        "risk_tolerance": risk_tolerance,
-        "output_path": None,
-        "error": None
-    }
+    # Get options from request
+    agreement_type = options.get("agreement_type", "General Agreement")
+    user_role = options.get("user_role", "Customer")
+    risk_tolerance = options.get("risk_tolerance", "Moderate")
+
+    if job_queue is not None:
+        job_queue.enqueue(
+            run_playbook_job,
+            kwargs={
+                "job_id": job_id,
+                "file_path": file_path,
+                "original_filename": filename,
+                "agreement_type": agreement_type,
+                "user_role": user_role,
+                "risk_tolerance": risk_tolerance
+            },
+            job_id=job_id,
+            meta={"progress": 0, "message": "Waiting for an available worker..."},
+            result_ttl=config.JOB_RESULT_TTL,
+            failure_ttl=config.JOB_RESULT_TTL
+        )
+    else:
+        # Initialize status
+        with processing_status_lock:
+            processing_status[job_id] = {
+                "status": "processing",
+                "progress": 0,
+                "message": "Uploading file...",
+                "file_path": file_path,
+                "original_filename": filename,
+                "agreement_type": agreement_type,
+                "user_role": user_role,
+                "risk_tolerance": risk_tolerance,
+                "output_path": None,
+                "error": None
+            }
 
     return jsonify({
         "job_id": job_id,
@@ -87,15 +190,79 @@ def upload_file():
     })
 
 
+def _store_upload(upload: HashingUploadFile, job_id: str, extension: str) -> str:
+    """
+    Move a finished upload to this job's path in UPLOAD_FOLDER.
+
+    Each job gets its own <sha256>-<job_id>.<ext> name, hard-linked to a
+    <sha256>.<ext> lookup link (see shared_upload_path) so identical uploads
+    share one file on disk. The link count is the reference count:
+    run_playbook removes its job's link when done, and the lookup link with
+    the last one.
+    """
+    digest = upload.sha256.hexdigest()
+    file_path = os.path.join(config.UPLOAD_FOLDER, f"{digest}-{job_id}.{extension}")
+    shared_path = shared_upload_path(file_path)
+    try:
+        os.link(shared_path, file_path)
+    except OSError:
+        # No pending job has this content (or no hard link support)
+        os.replace(upload.name, file_path)
+        try:
+            os.link(file_path, shared_path)
+        except OSError:
+            pass
+        return file_path
+
+    os.remove(upload.name)
+    # Refresh the shared timestamp so the cleanup sweep keeps it for this job
+    os.utime(file_path)
+    return file_path
+
+
+def _stream_to_file(stream) -> HashingUploadFile:
+    """Copy a request body into a new upload temp file in fixed-size chunks."""
+    upload = HashingUploadFile()
+    while True:
+        chunk = stream.read(UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            break
+        upload.write(chunk)
+    return upload
+
+
+def _discard_upload(file):
+    """Remove the spooled temp file of a rejected multipart upload."""
+    if file is None:
+        return
+    try:
+        file.stream.close()
+        os.remove(file.stream.name)
+    except Exception:
+        pass
+
+
 @app.route("/api/process/<job_id>", methods=["POST"])
 def process_file(job_id):
     """
-    Process the uploaded file and generate the playbook.
-    """
-    if job_id not in processing_status:
-        return jsonify({"error": "Job not found"}), 404
+    Start generating the playbook for an uploaded file.
 
-    job = processing_status[job_id]
+    Generation runs in a background thread (or on an RQ worker when a job
+    queue is configured), so this returns immediately. Follow progress with
+    /api/stream/<job_id> or /api/status/<job_id>.
+    """
+    if job_queue is not None:
+        job = _get_job(job_id)
+        if job is None:
+            return jsonify({"error": "Job not found"}), 404
+        return jsonify({"status": job["status"], "error": job["error"]})
+
+    with processing_status_lock:
+        job = processing_status.get(job_id)
+        if job is None:
+            return jsonify({"error": "Job not found"}), 404
+        start_job = job["status"] == "processing" and not job.get("started")
+        job["started"] = True
 
     if job["status"] == "completed":
         return jsonify({"status": "completed", "message": "Already processed"})
@@ -103,89 +270,152 @@ def process_file(job_id):
     if job["status"] == "error":
         return jsonify({"status": "error", "error": job["error"]})
 
+    if start_job:
+        threading.Thread(target=_run_job, args=(job_id, job), daemon=True).start()
+
+    return jsonify({
+        "status": "processing",
+        "message": "Processing started."
+    })
+
+
+def _run_job(job_id: str, job: dict):
+    """Generate the playbook for an in-memory job, recording progress on it."""
     try:
         # Update progress callback
         def update_progress(progress, message):
-            processing_status[job_id]["progress"] = progress
-            processing_status[job_id]["message"] = message
+            job["progress"] = progress
+            job["message"] = message
 
-        # Step 1: Parse document
-        update_progress(10, "Parsing document...")
-        doc_data = parse_document(job["file_path"])
-
-        if not doc_data.get("text"):
-            raise ValueError("Could not extract text from the document. Please ensure it's not a scanned image.")
-
-        # Step 2: Analyze with AI
-        update_progress(20, "Analyzing contract with AI...")
-        playbook_data = analyze_contract_chunked(
-            contract_text=doc_data["text"],
+        result = run_playbook(
+            job_id=job_id,
+            file_path=job["file_path"],
+            original_filename=job["original_filename"],
             agreement_type=job["agreement_type"],
             user_role=job["user_role"],
             risk_tolerance=job["risk_tolerance"],
-            progress_callback=lambda p, m: update_progress(20 + int(p * 0.6), m)
+            progress_callback=update_progress
         )
 
-        # Step 3: Generate Excel
-        update_progress(85, "Generating Excel playbook...")
-        output_filename = f"Playbook_{job['original_filename'].rsplit('.', 1)[0]}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
-        output_path = os.path.join(config.OUTPUT_FOLDER, output_filename)
-        generate_playbook_excel(playbook_data, output_path)
-
         # Update status
-        processing_status[job_id]["status"] = "completed"
-        processing_status[job_id]["progress"] = 100
-        processing_status[job_id]["message"] = "Playbook generated successfully!"
-        processing_status[job_id]["output_path"] = output_path
-        processing_status[job_id]["output_filename"] = output_filename
+        job["output_path"] = result["output_path"]
+        job["output_filename"] = result["output_filename"]
+        job["progress"] = 100
+        job["message"] = "Playbook generated successfully!"
+        job["status"] = "completed"
 
-        # Clean up uploaded file
-        try:
-            os.remove(job["file_path"])
-        except Exception:
-            pass
+    except Exception as e:
+        job["error"] = str(e)
+        job["message"] = f"Error: {str(e)}"
+        job["status"] = "error"
 
-        return jsonify({
-            "status": "completed",
-            "message": "Playbook generated successfully!",
-            "download_url": f"/api/download/{job_id}"
-        })
 
-    except Exception as e:
-        processing_status[job_id]["status"] = "error"
-        processing_status[job_id]["error"] = str(e)
-        processing_status[job_id]["message"] = f"Error: {str(e)}"
+def _get_job(job_id):
+    """
+    Look up a job's state.
 
-        return jsonify({
-            "status": "error",
-            "error": str(e)
-        }), 500
+    Returns a dict with the same keys as processing_status entries, read from
+    the RQ job when a queue is configured, or None if the job is unknown.
+    """
+    if job_queue is None:
+        with processing_status_lock:
+            return processing_status.get(job_id)
+
+    try:
+        rq_job = Job.fetch(job_id, connection=job_queue.connection)
+    except NoSuchJobError:
+        return None
+
+    rq_status = rq_job.get_status()
+    meta = rq_job.meta
+    job = {
+        "status": "processing",
+        "progress": meta.get("progress", 0),
+        "message": meta.get("message", ""),
+        "output_path": None,
+        "error": None
+    }
+
+    if rq_status == "finished":
+        result = rq_job.return_value() or {}
+        job["status"] = "completed"
+        job["progress"] = 100
+        job["message"] = "Playbook generated successfully!"
+        job["output_path"] = result.get("output_path")
+        job["output_filename"] = result.get("output_filename")
+    elif rq_status in ("failed", "stopped", "canceled"):
+        job["status"] = "error"
+        job["error"] = meta.get("error") or "Processing failed"
+
+    return job
 
 
 @app.route("/api/status/<job_id>")
 def get_status(job_id):
     """Get the processing status for a job."""
-    if job_id not in processing_status:
+    job = _get_job(job_id)
+    if job is None:
         return jsonify({"error": "Job not found"}), 404
 
-    job = processing_status[job_id]
-    return jsonify({
+    return jsonify(_status_payload(job_id, job))
+
+
+@app.route("/api/stream/<job_id>")
+def stream_status(job_id):
+    """
+    Stream a job's status as Server-Sent Events.
+
+    An event is sent whenever the status changes; the stream ends once the
+    job completes or fails, or after STATUS_STREAM_MAX_SECONDS so a long job
+    doesn't tie up a server thread (the client reconnects).
+    """
+    if _get_job(job_id) is None:
+        return jsonify({"error": "Job not found"}), 404
+
+    def event_stream():
+        yield f"retry: {STATUS_STREAM_RETRY_MS}\n\n"
+        deadline = time.monotonic() + STATUS_STREAM_MAX_SECONDS
+        last_payload = None
+        while True:
+            job = _get_job(job_id)
+            if job is None:
+                yield f"data: {json.dumps({'status': 'error', 'error': 'Job not found'})}\n\n"
+                return
+
+            payload = _status_payload(job_id, job)
+            if payload != last_payload:
+                yield f"data: {json.dumps(payload)}\n\n"
+                last_payload = payload
+
+            if job["status"] != "processing" or time.monotonic() >= deadline:
+                return
+            time.sleep(STATUS_STREAM_INTERVAL)
+
+    return Response(
+        event_stream(),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+def _status_payload(job_id: str, job: dict) -> dict:
+    """Build the public status response for a job."""
+    return {
         "status": job["status"],
         "progress": job["progress"],
         "message": job["message"],
         "error": job.get("error"),
         "download_url": f"/api/download/{job_id}" if job["status"] == "completed" else None
-    })
+    }
 
 
 @app.route("/api/download/<job_id>")
 def download_file(job_id):
     """Download the generated playbook."""
-    if job_id not in processing_status:
+    job = _get_job(job_id)
+    if job is None:
         return jsonify({"error": "Job not found"}), 404
 
-    job = processing_status[job_id]
-
     if job["status"] != "completed":
         return jsonify({"error": "Playbook not ready"}), 400
 
@@ -196,7 +426,8 @@ def download_file(job_id):
         job["output_path"],
         as_attachment=True,
         download_name=job.get("output_filename", "Playbook.xlsx"),
-        mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+        mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        conditional=True
     )
 
 
@@ -208,19 +439,50 @@ def health_check():
     return jsonify({
         "status": "healthy",
         "api_key_configured": api_configured,
-        "provider": "anthropic" if config.ANTHROPIC_API_KEY else "openai"
+        "provider": config.AI_PROVIDER
     })
 
 
+def _cleanup_expired_files():
+    """
+    Periodically delete uploads and generated playbooks older than JOB_RESULT_TTL,
+    and cached analyses older than PLAYBOOK_CACHE_TTL.
+
+    Covers files whose job record has expired, uploads left behind by failed
+    jobs, and partial uploads from interrupted requests. In the cache folder
+    that includes legacy uncompressed entries and temp files left by
+    interrupted writes; only the semantic index itself is kept.
+    """
+    while True:
+        now = time.time()
+        for folder, cutoff in (
+            (config.UPLOAD_FOLDER, now - config.JOB_RESULT_TTL),
+            (config.OUTPUT_FOLDER, now - config.JOB_RESULT_TTL),
+            (config.CACHE_FOLDER, now - config.PLAYBOOK_CACHE_TTL),
+        ):
+            for entry in os.scandir(folder):
+                try:
+                    if entry.name in CACHE_KEEP_FILES:
+                        continue
+                    if entry.is_file() and entry.stat().st_mtime < cutoff:
+                        os.remove(entry.path)
+                except OSError:
+                    pass
+        time.sleep(config.CLEANUP_INTERVAL)
+
+
+threading.Thread(target=_cleanup_expired_files, name="file-cleanup", daemon=True).start()
+
+
 if __name__ == "__main__":
     print(f"\n{'='*60}")
     print("Contract Playbook Builder")
     print(f"{'='*60}")
     print(f"Starting server on http://localhost:{config.PORT}")
 
-    if config.ANTHROPIC_API_KEY:
+    if config.AI_PROVIDER == "anthropic" and config.ANTHROPIC_API_KEY:
         print(f"AI Provider: Anthropic Claude ({config.ANTHROPIC_MODEL})")
-    elif config.OPENAI_API_KEY:
+    elif config.AI_PROVIDER == "openai" and config.OPENAI_API_KEY:
         print(f"AI Provider: OpenAI ({config.OPENAI_MODEL})")
     else:
         print("AI Provider: NOT CONFIGURED")
@@ -231,4 +493,9 @@ if __name__ == "__main__":
         print("Set with: export ANTHROPIC_API_KEY='your-key-here'")
         print("Or:       export OPENAI_API_KEY='your-key-here'\n")
 
-    app.run(host="0.0.0.0", port=config.PORT, debug=config.DEBUG)
+    if not config.DEBUG:
+        print("Development server - for production run: gunicorn -c gunicorn.conf.py app:app\n")
+
+    # threaded=True so concurrent uploads and status requests don't queue
+    # behind each other on the development server
+    app.run(host="0.0.0.0", port=config.PORT, debug=config.DEBUG, threaded=True)
@@ -11,16 +11,23 @@ load_dotenv()
 PORT = int(os.environ.get("PORT", 3005))
 DEBUG = os.environ.get("FLASK_DEBUG", "0") == "1"
 
+# Let a fronting web server (Apache mod_xsendfile, lighttpd) send downloads
+# via the X-Sendfile header instead of streaming them through Python
+USE_X_SENDFILE = os.environ.get("USE_X_SENDFILE", "0") == "1"
+
 # File upload settings
 UPLOAD_FOLDER = os.path.join(os.path.dirname(__file__), "uploads")
 OUTPUT_FOLDER = os.path.join(os.path.dirname(__file__), "output")
+CACHE_FOLDER = os.path.join(os.path.dirname(__file__), "cache")
 MAX_FILE_SIZE_MB = int(os.environ.get("MAX_FILE_SIZE", 50))
-ALLOWED_EXTENSIONS = {"pdf", "docx", "xlsx"}
+ALLOWED_EXTENSIONS = frozenset({"pdf", "docx", "xlsx"})
 
 # AI Provider settings
 # Primary: Anthropic Claude (preferred)
 ANTHROPIC_API_KEY = os.environ.get("ANTHROPIC_API_KEY", "")
 ANTHROPIC_MODEL = os.environ.get("ANTHROPIC_MODEL", "claude-sonnet-4-20250514")
+# Faster, cheaper model for the largely extractive calls (overview, definitions, exhibits)
+ANTHROPIC_FAST_MODEL = os.environ.get("ANTHROPIC_FAST_MODEL", "claude-haiku-4-5")
 
 # Fallback: OpenAI (if Anthropic not configured)
 OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY", "")
@@ -29,6 +36,45 @@ OPENAI_MODEL = os.environ.get("OPENAI_MODEL", "gpt-4o")
 # Which provider to use (anthropic or openai)
 AI_PROVIDER = os.environ.get("AI_PROVIDER", "anthropic" if ANTHROPIC_API_KEY else "openai")
 
+# Maximum AI requests in flight at once while analyzing one contract
+AI_CONCURRENCY = int(os.environ.get("AI_CONCURRENCY", 6))
+
+# Retries per AI request on rate limits (429), overload (529), server errors and
+# timeouts, with exponential backoff that honors Retry-After
+AI_MAX_RETRIES = int(os.environ.get("AI_MAX_RETRIES", 4))
+
+# Submit analyses through the provider's batch API (Anthropic Message Batches or
+# OpenAI Batch): half the token cost, but results can take minutes to hours
+AI_BATCH_MODE = os.environ.get("AI_BATCH", "0") == "1"
+
+# Cache AI analysis results on disk so identical re-runs skip the API calls
+PLAYBOOK_CACHE_ENABLED = os.environ.get("PLAYBOOK_CACHE", "1") == "1"
+PLAYBOOK_CACHE_TTL = int(os.environ.get("PLAYBOOK_CACHE_TTL", 30 * 86400))  # seconds
+
+# Semantic cache: reuse a playbook for near-duplicate contracts (requires OPENAI_API_KEY
+# for embeddings). Off by default since a match reuses another contract's analysis.
+SEMANTIC_CACHE_ENABLED = (
+    PLAYBOOK_CACHE_ENABLED
+    and os.environ.get("SEMANTIC_CACHE", "0") == "1"
+    and bool(OPENAI_API_KEY)
+)
+SEMANTIC_CACHE_THRESHOLD = float(os.environ.get("SEMANTIC_CACHE_THRESHOLD", 0.9))
+EMBEDDING_MODEL = os.environ.get("EMBEDDING_MODEL", "text-embedding-3-small")
+
+# Job queue settings
+# When REDIS_URL is set, playbooks are generated by RQ workers (`rq worker playbooks`)
+# instead of inside the web request.
+REDIS_URL = os.environ.get("REDIS_URL", "")
+JOB_QUEUE_NAME = os.environ.get("JOB_QUEUE_NAME", "playbooks")
+JOB_TIMEOUT = int(os.environ.get("JOB_TIMEOUT", 1800))  # seconds
+JOB_RESULT_TTL = int(os.environ.get("JOB_RESULT_TTL", 86400))  # seconds
+
+# Job records, uploads and generated playbooks older than JOB_RESULT_TTL are
+# removed; the cleanup pass runs every CLEANUP_INTERVAL seconds.
+MAX_TRACKED_JOBS = int(os.environ.get("MAX_TRACKED_JOBS", 10000))
+CLEANUP_INTERVAL = int(os.environ.get("CLEANUP_INTERVAL", 3600))  # seconds
+
 # Ensure directories exist
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs(OUTPUT_FOLDER, exist_ok=True)
+os.makedirs(CACHE_FOLDER, exist_ok=True)
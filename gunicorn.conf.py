@@ -0,0 +1,18 @@
+"""
+Gunicorn settings for production: gunicorn -c gunicorn.conf.py app:app
+"""
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 3005)}"
+
+# In-process jobs keep their status in the web process's memory, so multiple
+# worker processes are only safe when jobs go through the Redis queue
+workers = int(os.environ.get("WEB_CONCURRENCY", 4 if os.environ.get("REDIS_URL") else 1))
+worker_class = "gthread"
+# Threads per worker. An open progress stream (/api/stream) holds one for up to
+# STATUS_STREAM_MAX_SECONDS before the browser reconnects, so raise this if
+# many jobs are watched at once
+threads = int(os.environ.get("GUNICORN_THREADS", 8))
+
+# Large uploads over slow connections can take a while
+timeout = 600
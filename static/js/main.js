@@ -21,6 +21,7 @@ const errorMessage = document.getElementById('error-message');
 // State
 let currentJobId = null;
 let statusPollInterval = null;
+let statusStream = null;
 let reassuranceInterval = null;
 let reassuranceIndex = 0;
 
@@ -124,42 +125,18 @@ uploadForm.addEventListener('submit', async (e) => {
         updateProgress(5, 'Starting analysis...');
         startReassuranceRotation();
 
-        // Start polling for status updates - this is the primary completion detection
-        startPollingStatus(currentJobId);
-
-        // Start processing in background (don't await - it takes minutes)
-        // The polling will detect completion, but we also handle it here as backup
-        fetch(`/api/process/${currentJobId}`, {
+        // Start processing - the server runs it in the background and returns immediately
+        const processResponse = await fetch(`/api/process/${currentJobId}`, {
             method: 'POST'
-        }).then(response => response.json()).then(processData => {
-            // Processing complete - the polling should have already detected this
-            // but handle here as backup in case polling missed it
-            if (processData.status === 'completed') {
-                if (statusPollInterval) {
-                    clearInterval(statusPollInterval);
-                }
-                stopReassuranceRotation();
-                showSection('result');
-                downloadBtn.onclick = () => downloadPlaybook(currentJobId);
-            } else if (processData.status === 'error') {
-                if (statusPollInterval) {
-                    clearInterval(statusPollInterval);
-                }
-                stopReassuranceRotation();
-                showError(processData.error || 'Processing failed');
-            }
-            // If neither completed nor error, let polling continue to handle it
-        }).catch(error => {
-            // Only show error if we're still in processing state
-            // (polling might have already handled completion)
-            if (progressSection && !progressSection.classList.contains('hidden')) {
-                if (statusPollInterval) {
-                    clearInterval(statusPollInterval);
-                }
-                stopReassuranceRotation();
-                showError(error.message || 'Processing failed');
-            }
         });
+        const processData = await processResponse.json();
+
+        if (processData.status === 'error' || !processResponse.ok) {
+            throw new Error(processData.error || 'Processing failed');
+        }
+
+        // Follow progress via server-sent events (falls back to polling)
+        startStatusStream(currentJobId);
 
     } catch (error) {
         showError(error.message);
@@ -202,29 +179,65 @@ function stopReassuranceRotation() {
     }
 }
 
+function handleStatusUpdate(jobId, data) {
+    updateProgress(data.progress, data.message);
+
+    if (data.status === 'completed') {
+        stopStatusUpdates();
+        showSection('result');
+        downloadBtn.onclick = () => downloadPlaybook(jobId);
+    } else if (data.status === 'error') {
+        showError(data.error || 'An error occurred');
+    }
+}
+
+function startStatusStream(jobId) {
+    if (!window.EventSource) {
+        startPollingStatus(jobId);
+        return;
+    }
+
+    statusStream = new EventSource(`/api/stream/${jobId}`);
+    statusStream.onmessage = (event) => {
+        handleStatusUpdate(jobId, JSON.parse(event.data));
+    };
+    statusStream.onerror = () => {
+        // The server ends each stream after a short while and the browser
+        // reconnects on its own; if it gives up instead, fall back to polling
+        if (statusStream && statusStream.readyState === EventSource.CLOSED) {
+            statusStream.close();
+            statusStream = null;
+            if (!progressSection.classList.contains('hidden')) {
+                startPollingStatus(jobId);
+            }
+        }
+    };
+}
+
 function startPollingStatus(jobId) {
     statusPollInterval = setInterval(async () => {
         try {
             const response = await fetch(`/api/status/${jobId}`);
             const data = await response.json();
-
-            updateProgress(data.progress, data.message);
-
-            if (data.status === 'completed') {
-                clearInterval(statusPollInterval);
-                showSection('result');
-                downloadBtn.onclick = () => downloadPlaybook(jobId);
-            } else if (data.status === 'error') {
-                clearInterval(statusPollInterval);
-                showError(data.error || 'An error occurred');
-            }
+            handleStatusUpdate(jobId, data);
         } catch (error) {
-            clearInterval(statusPollInterval);
             showError('Lost connection to server');
         }
     }, 1000);
 }
 
+function stopStatusUpdates() {
+    if (statusStream) {
+        statusStream.close();
+        statusStream = null;
+    }
+    if (statusPollInterval) {
+        clearInterval(statusPollInterval);
+        statusPollInterval = null;
+    }
+    stopReassuranceRotation();
+}
+
 // Download
 async function downloadPlaybook(jobId) {
     window.location.href = `/api/download/${jobId}`;
@@ -256,19 +269,12 @@ function showSection(section) {
 function showError(message) {
     errorMessage.textContent = message;
     showSection('error');
-
-    if (statusPollInterval) {
-        clearInterval(statusPollInterval);
-    }
-    stopReassuranceRotation();
+    stopStatusUpdates();
 }
 
 function startOver() {
     currentJobId = null;
-    if (statusPollInterval) {
-        clearInterval(statusPollInterval);
-    }
-    stopReassuranceRotation();
+    stopStatusUpdates();
     reassuranceIndex = 0;
 
     // Reset form
@@ -1,90 +1,135 @@
 """
 Document parser for extracting text from PDF, DOCX, and XLSX files.
 """
+import io
 import os
-from PyPDF2 import PdfReader
+import re
+from concurrent.futures import ProcessPoolExecutor
+import pypdfium2 as pdfium
 from docx import Document
 from openpyxl import load_workbook
 
+# PDFs with at least this many pages have their text extracted across processes
+PARALLEL_PDF_MIN_PAGES = 200
 
-def allowed_file(filename: str, allowed_extensions: set) -> bool:
+# Section header patterns for extract_sections, tried in order. Keywords are
+# matched case-insensitively via scoped (?i:...) groups so the all-caps header
+# pattern stays selective. Its body is capped to avoid runaway backtracking on
+# long documents.
+_SECTION_PATTERNS = [
+    re.compile(p, re.MULTILINE | re.DOTALL) for p in [
+        r'^(\d+\.)\s+(.+?)(?=\n\d+\.|$)',  # 1. Section Name
+        r'^(\d+\.\d+)\s+(.+?)(?=\n\d+\.\d+|$)',  # 1.1 Subsection
+        r'^((?i:section)\s+\d+[.:])(.+?)(?=(?i:section)\s+\d+|$)',  # Section 1:
+        r'^((?i:article)\s+[IVXivx\d]+[.:])(.+?)(?=(?i:article)\s+|$)',  # ARTICLE I:
+        r'^([A-Z][A-Z\s]{2,}:)(.{1,5000}?)(?=[A-Z][A-Z\s]{2,}:|$)',  # HEADER:
+    ]
+]
+
+
+def allowed_file(filename: str, allowed_extensions: frozenset) -> bool:
     """Check if file has an allowed extension."""
-    return "." in filename and filename.rsplit(".", 1)[1].lower() in allowed_extensions
+    return get_file_extension(filename) in allowed_extensions
 
 
 def get_file_extension(filename: str) -> str:
     """Get the file extension in lowercase."""
-    return filename.rsplit(".", 1)[1].lower() if "." in filename else ""
+    return os.path.splitext(filename)[1][1:].lower()
+
+
+def _page_text(pdf, index: int) -> str:
+    """Extract the text of one page from an open PdfDocument."""
+    page = pdf[index]
+    textpage = page.get_textpage()
+    try:
+        return textpage.get_text_range().replace("\r\n", "\n")
+    finally:
+        textpage.close()
+        page.close()
+
+
+def _extract_page_range(args: tuple) -> list:
+    """Extract text from pages [start, end) of a PDF (process pool worker)."""
+    file_path, start, end = args
+    pdf = pdfium.PdfDocument(file_path)
+    try:
+        return [_page_text(pdf, i) for i in range(start, end)]
+    finally:
+        pdf.close()
 
 
-def parse_pdf(file_path: str) -> dict:
+def parse_pdf(file_path: str, collect_structure: bool = False) -> dict:
     """
     Extract text from a PDF file.
 
     Returns:
-        dict with 'text' (full text), 'pages' (list of page texts), 'metadata'
+        dict with 'text' (full text), 'metadata', and with collect_structure
+        'pages' (list of page texts) and 'page_count'
     """
-    reader = PdfReader(file_path)
-    pages = []
-    full_text = []
-
-    for page_num, page in enumerate(reader.pages, 1):
-        page_text = page.extract_text() or ""
-        pages.append({
-            "page_number": page_num,
-            "text": page_text
-        })
-        full_text.append(page_text)
-
-    metadata = {}
-    if reader.metadata:
-        metadata = {
-            "title": reader.metadata.get("/Title", ""),
-            "author": reader.metadata.get("/Author", ""),
-            "subject": reader.metadata.get("/Subject", ""),
-            "creator": reader.metadata.get("/Creator", ""),
-        }
+    pdf = pdfium.PdfDocument(file_path)
+    try:
+        page_count = len(pdf)
+        raw_metadata = pdf.get_metadata_dict()
+        workers = min(os.cpu_count() or 1, page_count)
+        parallel = page_count >= PARALLEL_PDF_MIN_PAGES and workers > 1
+        if not parallel:
+            texts = [_page_text(pdf, i) for i in range(page_count)]
+    finally:
+        pdf.close()
+
+    if parallel:
+        # PDFium is not thread-safe, so very long documents are split into
+        # one contiguous page range per process, each opening its own copy.
+        step = -(-page_count // workers)
+        ranges = [(file_path, start, min(start + step, page_count)) for start in range(0, page_count, step)]
+        with ProcessPoolExecutor(max_workers=len(ranges)) as executor:
+            texts = [text for chunk in executor.map(_extract_page_range, ranges) for text in chunk]
+
+    metadata = {
+        "title": raw_metadata.get("Title", ""),
+        "author": raw_metadata.get("Author", ""),
+        "subject": raw_metadata.get("Subject", ""),
+        "creator": raw_metadata.get("Creator", ""),
+    }
 
-    return {
-        "text": "\n\n".join(full_text),
-        "pages": pages,
-        "page_count": len(pages),
+    result = {
+        "text": "\n\n".join(texts),
         "metadata": metadata,
         "format": "pdf"
     }
 
+    if collect_structure:
+        result["pages"] = [
+            {"page_number": page_num, "text": page_text}
+            for page_num, page_text in enumerate(texts, 1)
+        ]
+        result["page_count"] = page_count
+
+    return result
 
-def parse_docx(file_path: str) -> dict:
+
+def parse_docx(file_path: str, collect_structure: bool = False) -> dict:
     """
     Extract text from a Word document.
 
     Returns:
-        dict with 'text' (full text), 'paragraphs' (list), 'tables' (list), 'metadata'
+        dict with 'text' (full text), 'metadata', and with collect_structure
+        'paragraphs' (list) and 'tables' (list)
     """
     doc = Document(file_path)
 
+    texts = []
     paragraphs = []
-    full_text = []
 
     for para in doc.paragraphs:
-        if para.text.strip():
-            paragraphs.append({
-                "text": para.text,
-                "style": para.style.name if para.style else "Normal"
-            })
-            full_text.append(para.text)
-
-    # Extract tables
-    tables = []
-    for table_idx, table in enumerate(doc.tables):
-        table_data = []
-        for row in table.rows:
-            row_data = [cell.text for cell in row.cells]
-            table_data.append(row_data)
-        tables.append({
-            "table_number": table_idx + 1,
-            "data": table_data
-        })
+        text = para.text
+        if text.strip():
+            texts.append(text)
+            if collect_structure:
+                paragraphs.append({
+                    "text": text,
+                    "style": para.style.name if para.style else "Normal"
+                })
 
     # Get metadata from core properties
     metadata = {}
@@ -99,71 +144,120 @@ def parse_docx(file_path: str) -> dict:
     except Exception:
         pass
 
-    return {
-        "text": "\n\n".join(full_text),
-        "paragraphs": paragraphs,
-        "tables": tables,
-        "paragraph_count": len(paragraphs),
-        "table_count": len(tables),
+    result = {
+        "text": "\n\n".join(texts),
         "metadata": metadata,
         "format": "docx"
     }
 
+    if collect_structure:
+        # Extract tables
+        tables = []
+        for table_idx, table in enumerate(doc.tables):
+            table_data = []
+            for row in table.rows:
+                row_data = [cell.text for cell in row.cells]
+                table_data.append(row_data)
+            tables.append({
+                "table_number": table_idx + 1,
+                "data": table_data
+            })
+
+        result.update({
+            "paragraphs": paragraphs,
+            "tables": tables,
+            "paragraph_count": len(paragraphs),
+            "table_count": len(tables)
+        })
+
+    return result
 
-def parse_xlsx(file_path: str) -> dict:
+
+def parse_xlsx(file_path: str, collect_structure: bool = False) -> dict:
     """
     Extract text from an Excel file.
 
     Returns:
-        dict with 'text' (full text), 'sheets' (list of sheet data), 'metadata'
+        dict with 'text' (full text), 'metadata', and with collect_structure
+        'sheets' (list of sheet data)
     """
-    workbook = load_workbook(file_path, data_only=True)
+    # Read-only mode streams rows as plain values instead of building a Cell
+    # object for every cell in the workbook
+    workbook = load_workbook(file_path, data_only=True, read_only=True)
 
     sheets = []
-    full_text = []
-
-    for sheet_name in workbook.sheetnames:
-        sheet = workbook[sheet_name]
-        sheet_data = []
-        sheet_text = []
-
-        for row in sheet.iter_rows():
-            row_data = []
-            row_text = []
-            for cell in row:
-                value = str(cell.value) if cell.value is not None else ""
-                row_data.append(value)
-                if value:
-                    row_text.append(value)
-            sheet_data.append(row_data)
-            if row_text:
-                sheet_text.append(" | ".join(row_text))
-
-        sheets.append({
-            "name": sheet_name,
-            "data": sheet_data,
-            "row_count": len(sheet_data),
-            "col_count": sheet.max_column
-        })
+    # Text is written straight into one buffer: a "--- Sheet: name ---" header
+    # per sheet with text, then one " | "-separated line per non-empty row
+    buf = io.StringIO()
 
-        if sheet_text:
-            full_text.append(f"--- Sheet: {sheet_name} ---\n" + "\n".join(sheet_text))
+    try:
+        for sheet_name in workbook.sheetnames:
+            sheet = workbook[sheet_name]
+            sheet_data = []
+            sheet_started = False
+            col_count = 0
+
+            for row in sheet.iter_rows(values_only=True):
+                row_started = False
+                for value in row:
+                    if value is None or value == "":
+                        continue
+                    if row_started:
+                        buf.write(" | ")
+                    else:
+                        if not sheet_started:
+                            if buf.tell():
+                                buf.write("\n\n")
+                            buf.write(f"--- Sheet: {sheet_name} ---")
+                            sheet_started = True
+                        buf.write("\n")
+                        row_started = True
+                    buf.write(str(value))
+
+                if collect_structure:
+                    sheet_data.append(["" if value is None else str(value) for value in row])
+                    col_count = max(col_count, len(row))
+
+            if collect_structure:
+                sheets.append({
+                    "name": sheet_name,
+                    "data": sheet_data,
+                    "row_count": len(sheet_data),
+                    "col_count": col_count
+                })
+    finally:
+        # Read-only workbooks keep the file open until closed
+        workbook.close()
 
-    return {
-        "text": "\n\n".join(full_text),
-        "sheets": sheets,
-        "sheet_count": len(sheets),
+    result = {
+        "text": buf.getvalue(),
         "metadata": {},
         "format": "xlsx"
     }
 
+    if collect_structure:
+        result["sheets"] = sheets
+        result["sheet_count"] = len(sheets)
+
+    return result
 
-def parse_document(file_path: str) -> dict:
+
+# Parser for each supported file extension
+_PARSERS = {
+    "pdf": parse_pdf,
+    "docx": parse_docx,
+    "xlsx": parse_xlsx,
+}
+
+
+def parse_document(file_path: str, collect_structure: bool = False) -> dict:
     """
     Parse a document and extract its text content.
 
     Args:
         file_path: Path to the document file
+        collect_structure: Also return per-page/paragraph/table/sheet data.
+            Playbook generation only needs the text, so this is off by default.
 
     Returns:
         dict containing extracted text and metadata
@@ -176,16 +270,12 @@ def parse_document(file_path: str) -> dict:
         raise FileNotFoundError(f"File not found: {file_path}")
 
     extension = get_file_extension(file_path)
-
-    if extension == "pdf":
-        return parse_pdf(file_path)
-    elif extension == "docx":
-        return parse_docx(file_path)
-    elif extension == "xlsx":
-        return parse_xlsx(file_path)
-    else:
+    parser = _PARSERS.get(extension)
+    if parser is None:
         raise ValueError(f"Unsupported file format: {extension}")
 
+    return parser(file_path, collect_structure)
+
 
 def extract_sections(text: str) -> list:
     """
@@ -195,21 +285,10 @@ def extract_sections(text: str) -> list:
     Returns:
         List of dicts with 'header' and 'content' keys
     """
-    import re
-
     sections = []
 
-    # Common section patterns
-    patterns = [
-        r'^(\d+\.)\s+(.+?)(?=\n\d+\.|$)',  # 1. Section Name
-        r'^(\d+\.\d+)\s+(.+?)(?=\n\d+\.\d+|$)',  # 1.1 Subsection
-        r'^(Section\s+\d+[.:])(.+?)(?=Section\s+\d+|$)',  # Section 1:
-        r'^(ARTICLE\s+[IVX\d]+[.:])(.+?)(?=ARTICLE\s+|$)',  # ARTICLE I:
-        r'^([A-Z][A-Z\s]{2,}:)(.+?)(?=[A-Z][A-Z\s]{2,}:|$)',  # HEADER:
-    ]
-
-    for pattern in patterns:
-        matches = re.findall(pattern, text, re.MULTILINE | re.DOTALL | re.IGNORECASE)
+    for pattern in _SECTION_PATTERNS:
+        matches = pattern.findall(text)
         if matches:
             for match in matches:
                 sections.append({
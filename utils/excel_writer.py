@@ -4,40 +4,65 @@ Excel playbook writer with topic-based sheet organization.
 Creates professional contract playbooks matching the structure of
 high-quality legal playbooks with separate sheets per topic.
 """
-from openpyxl import Workbook
-from openpyxl.styles import Font, Alignment, PatternFill, Border, Side
-from openpyxl.utils import get_column_letter
-
-
-# Styling
-HEADER_FONT = Font(bold=True, size=11, color="FFFFFF")
-HEADER_FILL = PatternFill(start_color="2B579A", end_color="2B579A", fill_type="solid")
-TITLE_FONT = Font(bold=True, size=18, color="2B579A")
-SECTION_FONT = Font(bold=True, size=12)
-THIN_BORDER = Border(
-    left=Side(style='thin', color='CCCCCC'),
-    right=Side(style='thin', color='CCCCCC'),
-    top=Side(style='thin', color='CCCCCC'),
-    bottom=Side(style='thin', color='CCCCCC')
-)
-WRAP_ALIGNMENT = Alignment(wrap_text=True, vertical='top')
-ALT_ROW_FILL = PatternFill(start_color="F5F5F5", end_color="F5F5F5", fill_type="solid")
-
-# Column structure for clause analysis sheets
-CLAUSE_COLUMNS = [
-    ("Section", 10),
-    ("Subsection", 12),
-    ("Issue", 25),
-    ("Current Language", 50),
-    ("Purpose/Rationale", 40),
-    ("Customer Concerns", 40),
-    ("Customer Edits to Watch", 35),
-    ("Provider Position", 40),
-    ("Acceptable Modifications", 40),
-    ("Fallback Language", 50),
-    ("Do Not Accept", 35),
-    ("Notes", 30)
-]
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import xlsxwriter
+
+from utils.playbook_common import CLAUSE_FIELDS
+
+
+# Styling (xlsxwriter format properties, registered per workbook by _add_formats)
+_BORDER = {"border": 1, "border_color": "#CCCCCC"}
+_WRAP = {"text_wrap": True, "valign": "top"}
+FORMATS = {
+    "title": {"bold": True, "font_size": 18, "font_color": "#2B579A"},
+    "section": {"bold": True, "font_size": 12},
+    "subtitle": {"bold": True, "font_size": 14, "font_color": "#2B579A"},
+    "note": {"italic": True, "font_color": "#666666"},
+    "bold": {"bold": True},
+    "wrap": _WRAP,
+    "header": {"bold": True, "font_color": "#FFFFFF", "bg_color": "#2B579A", **_BORDER},
+    "header_centered": {
+        "bold": True, "font_color": "#FFFFFF", "bg_color": "#2B579A",
+        "align": "center", "valign": "vcenter", **_BORDER
+    },
+    "row": {**_WRAP, **_BORDER},
+    "alt_row": {**_WRAP, **_BORDER, "bg_color": "#F5F5F5"},
+}
+
+# Workbook options: cells are streamed to disk row by row, and contract text
+# is always written as plain text, never turned into formulas or hyperlinks
+WORKBOOK_OPTIONS = {
+    "constant_memory": True,
+    "strings_to_formulas": False,
+    "strings_to_urls": False,
+}
+
+# Header and width of each clause analysis sheet column, keyed by the clause
+# field it shows. Columns follow the order of the schema's CLAUSE_FIELDS, and
+# every field there needs an entry here.
+CLAUSE_COLUMNS = {
+    "section": ("Section", 10),
+    "subsection": ("Subsection", 12),
+    "issue": ("Issue", 25),
+    "current_language": ("Current Language", 50),
+    "purpose_rationale": ("Purpose/Rationale", 40),
+    "customer_concerns": ("Customer Concerns", 40),
+    "customer_edits_to_watch": ("Customer Edits to Watch", 35),
+    "provider_position": ("Provider Position", 40),
+    "acceptable_modifications": ("Acceptable Modifications", 40),
+    "fallback_language": ("Fallback Language", 50),
+    "do_not_accept": ("Do Not Accept", 35),
+    "notes": ("Notes", 30)
+}
+
+# Replacements for characters Excel doesn't allow in sheet names: / \ ? * [ ] :
+_SHEET_NAME_TABLE = str.maketrans({"/": "-", "\\": "-", "?": "", "*": "", "[": "", "]": "", ":": "-"})
+
+# Line prefix for list items rendered by format_list
+BULLET = "• "
 
 
 def generate_playbook_excel(playbook_data: dict, output_path: str):
@@ -48,39 +73,106 @@ def generate_playbook_excel(playbook_data: dict, output_path: str):
         playbook_data: The structured playbook data from Claude analysis
         output_path: Path to save the Excel file
     """
-    wb = Workbook()
+    # Save to a temporary file and move it into place, so a failed or
+    # interrupted save never leaves a truncated playbook at output_path
+    with tempfile.NamedTemporaryFile(
+        dir=os.path.dirname(output_path) or ".", suffix=".xlsx.tmp", delete=False
+    ) as f:
+        tmp_path = f.name
+    try:
+        with xlsxwriter.Workbook(tmp_path, WORKBOOK_OPTIONS) as wb:
+            formats = _add_formats(wb)
+
+            # Create Overview sheet
+            create_overview_sheet(
+                wb, formats, playbook_data.get("overview", {}), playbook_data.get("failed_topics", [])
+            )
+
+            # Create topic sheets
+            topics = playbook_data.get("topics", {})
+            for topic_name, clauses in topics.items():
+                if clauses:  # Only create sheet if there are clauses
+                    create_topic_sheet(wb, formats, topic_name, clauses)
+
+            # Create Quick Reference sheet
+            create_quick_reference_sheet(wb, formats, playbook_data.get("quick_reference", []))
+
+        # NamedTemporaryFile creates files as 0600; make the playbook readable
+        # by a fronting server (USE_X_SENDFILE)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, output_path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    return output_path
+
 
-    # Remove default sheet
-    if "Sheet" in wb.sheetnames:
-        del wb["Sheet"]
+def _generate_playbook_excel_item(item: tuple) -> str:
+    """Unpack a (playbook_data, output_path) pair (process pool worker)."""
+    return generate_playbook_excel(*item)
 
-    # Create Overview sheet
-    create_overview_sheet(wb, playbook_data.get("overview", {}))
 
-    # Create topic sheets
-    topics = playbook_data.get("topics", {})
-    for topic_name, clauses in topics.items():
-        if clauses:  # Only create sheet if there are clauses
-            create_topic_sheet(wb, topic_name, clauses)
+def generate_playbooks_excel(items: list) -> list:
+    """
+    Generate several playbooks in parallel.
 
-    # Create Quick Reference sheet
-    create_quick_reference_sheet(wb, playbook_data.get("quick_reference", []))
+    Building a workbook is pure Python and a Workbook can't be shared between
+    threads, so a single workbook can't be split up; separate workbooks are
+    built in separate processes instead.
+
+    Args:
+        items: List of (playbook_data, output_path) pairs
+
+    Returns:
+        List of output paths, in the same order as items
+    """
+    if not items:
+        return []
+    workers = min(os.cpu_count() or 1, len(items))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(_generate_playbook_excel_item, items))
 
-    wb.save(output_path)
-    return output_path
 
+def _add_formats(wb: xlsxwriter.Workbook) -> dict:
+    """Register the FORMATS styles with a workbook."""
+    return {name: wb.add_format(props) for name, props in FORMATS.items()}
 
-def create_overview_sheet(wb: Workbook, overview: dict):
+
+def format_list(items, prefix: str = "•"):
+    """
+    Render a clause field for a cell.
+
+    The model is asked for bullet fields as "• a\\n• b" strings but sometimes
+    returns a JSON list instead, which a cell cannot hold. Lists are joined
+    into one bullet per line; any other value is returned unchanged.
+    """
+    if not isinstance(items, (list, tuple)):
+        return items
+    if any(isinstance(item, dict) for item in items):
+        items = [
+            " - ".join(str(v) for v in item.values() if v) if isinstance(item, dict) else item
+            for item in items
+        ]
+    bullet = BULLET if prefix == "•" else f"{prefix} "
+    return "\n".join(
+        bullet + text.lstrip("•-* ").strip()
+        for text in map(str, items) if text.strip()
+    )
+
+
+def create_overview_sheet(wb: xlsxwriter.Workbook, formats: dict, overview: dict, failed_topics: list = ()):
     """Create the Overview sheet with agreement summary and guidance."""
-    ws = wb.create_sheet("Overview", 0)
+    ws = wb.add_worksheet("Overview")
+
+    # Set column widths
+    ws.set_column(0, 0, 25)
+    ws.set_column(1, 1, 80)
 
     # Title
     title = overview.get("title", "Contract Playbook")
-    ws["A1"] = f"{title} Contracting Playbook"
-    ws["A1"].font = TITLE_FONT
-    ws.merge_cells("A1:B1")
+    ws.merge_range(0, 0, 0, 1, f"{title} Contracting Playbook", formats["title"])
 
-    row = 3
+    row = 2
 
     # Agreement details
     details = [
@@ -93,132 +185,89 @@ def create_overview_sheet(wb: Workbook, overview: dict):
 
     for label, value in details:
         if value:
-            ws.cell(row=row, column=1, value=label).font = Font(bold=True)
-            ws.cell(row=row, column=2, value=value)
+            ws.write(row, 0, label, formats["bold"])
+            ws.write(row, 1, value)
             row += 1
 
+    if failed_topics:
+        ws.write(row, 0, "Not Analyzed:", formats["bold"])
+        ws.write(row, 1, f"{', '.join(failed_topics)} (analysis failed; regenerate the playbook to retry)",
+                 formats["note"])
+        row += 1
+
     row += 1
 
     # Key Principles
-    ws.cell(row=row, column=1, value="KEY PRINCIPLES").font = SECTION_FONT
+    ws.write(row, 0, "KEY PRINCIPLES", formats["section"])
     row += 1
 
     for i, principle in enumerate(overview.get("key_principles", []), 1):
-        ws.cell(row=row, column=1, value=f"{i}. {principle}")
-        ws.cell(row=row, column=1).alignment = WRAP_ALIGNMENT
+        ws.write(row, 0, f"{i}. {principle}", formats["wrap"])
         row += 1
 
     row += 1
 
     # Executive Summary
-    ws.cell(row=row, column=1, value="EXECUTIVE SUMMARY").font = SECTION_FONT
+    ws.write(row, 0, "EXECUTIVE SUMMARY", formats["section"])
     row += 1
     summary = overview.get("executive_summary", "")
-    ws.cell(row=row, column=1, value=summary)
-    ws.cell(row=row, column=1).alignment = WRAP_ALIGNMENT
-    ws.merge_cells(f"A{row}:B{row}")
-    ws.row_dimensions[row].height = 100
+    ws.set_row(row, 100)
+    ws.merge_range(row, 0, row, 1, summary, formats["wrap"])
     row += 2
 
     # How to Use
-    ws.cell(row=row, column=1, value="HOW TO USE THIS PLAYBOOK").font = SECTION_FONT
+    ws.write(row, 0, "HOW TO USE THIS PLAYBOOK", formats["section"])
     row += 1
 
     for i, instruction in enumerate(overview.get("how_to_use", []), 1):
-        ws.cell(row=row, column=1, value=f"{i}. {instruction}")
-        ws.cell(row=row, column=1).alignment = WRAP_ALIGNMENT
+        ws.write(row, 0, f"{i}. {instruction}", formats["wrap"])
         row += 1
 
-    # Set column widths
-    ws.column_dimensions["A"].width = 25
-    ws.column_dimensions["B"].width = 80
-
 
-def create_topic_sheet(wb: Workbook, topic_name: str, clauses: list):
+def create_topic_sheet(wb: xlsxwriter.Workbook, formats: dict, topic_name: str, clauses: list):
     """Create a sheet for a specific contract topic."""
     # Sanitize sheet name - remove invalid characters and truncate
-    # Excel doesn't allow: / \ ? * [ ] :
-    sheet_name = topic_name.replace("/", "-").replace("\\", "-").replace("?", "").replace("*", "").replace("[", "").replace("]", "").replace(":", "-")
-    sheet_name = sheet_name[:31] if len(sheet_name) > 31 else sheet_name
-    ws = wb.create_sheet(sheet_name)
+    sheet_name = topic_name.translate(_SHEET_NAME_TABLE)[:31]
+    ws = wb.add_worksheet(sheet_name)
 
-    # Headers
-    for col_idx, (header, width) in enumerate(CLAUSE_COLUMNS, 1):
-        cell = ws.cell(row=1, column=col_idx, value=header)
-        cell.font = HEADER_FONT
-        cell.fill = HEADER_FILL
-        cell.alignment = Alignment(horizontal='center', vertical='center')
-        cell.border = THIN_BORDER
-        ws.column_dimensions[get_column_letter(col_idx)].width = width
+    columns = [CLAUSE_COLUMNS[field] for field in CLAUSE_FIELDS]
+    for col_idx, (_, width) in enumerate(columns):
+        ws.set_column(col_idx, col_idx, width)
 
     # Freeze header row
-    ws.freeze_panes = "A2"
-
-    # Add clause data
-    for row_idx, clause in enumerate(clauses, 2):
-        ws.cell(row=row_idx, column=1, value=clause.get("section", "")).border = THIN_BORDER
-        ws.cell(row=row_idx, column=2, value=clause.get("subsection", "")).border = THIN_BORDER
-        ws.cell(row=row_idx, column=3, value=clause.get("issue", "")).border = THIN_BORDER
-        ws.cell(row=row_idx, column=4, value=clause.get("current_language", "")).border = THIN_BORDER
-        ws.cell(row=row_idx, column=5, value=clause.get("purpose_rationale", "")).border = THIN_BORDER
-        ws.cell(row=row_idx, column=6, value=clause.get("customer_concerns", "")).border = THIN_BORDER
-        ws.cell(row=row_idx, column=7, value=clause.get("customer_edits_to_watch", "")).border = THIN_BORDER
-        ws.cell(row=row_idx, column=8, value=clause.get("provider_position", "")).border = THIN_BORDER
-        ws.cell(row=row_idx, column=9, value=clause.get("acceptable_modifications", "")).border = THIN_BORDER
-        ws.cell(row=row_idx, column=10, value=clause.get("fallback_language", "")).border = THIN_BORDER
-        ws.cell(row=row_idx, column=11, value=clause.get("do_not_accept", "")).border = THIN_BORDER
-        ws.cell(row=row_idx, column=12, value=clause.get("notes", "")).border = THIN_BORDER
-
-        # Apply wrap text and alternating row colors
-        for col in range(1, 13):
-            cell = ws.cell(row=row_idx, column=col)
-            cell.alignment = WRAP_ALIGNMENT
-            if row_idx % 2 == 0:
-                cell.fill = ALT_ROW_FILL
-
-    # Set row heights for better readability
-    for row in range(2, len(clauses) + 2):
-        ws.row_dimensions[row].height = 80
-
-
-def create_quick_reference_sheet(wb: Workbook, quick_reference: list):
-    """Create the Quick Reference sheet with hard limits."""
-    ws = wb.create_sheet("Quick Reference")
+    ws.freeze_panes(1, 0)
 
-    # Title
-    ws["A1"] = "Quick Reference - Hard Limits"
-    ws["A1"].font = Font(bold=True, size=14, color="2B579A")
-    ws.merge_cells("A1:B1")
+    # Headers
+    ws.write_row(0, 0, [header for header, _ in columns], formats["header_centered"])
 
-    ws["A2"] = "Items below require executive approval before deviating from standard position"
-    ws["A2"].font = Font(italic=True, color="666666")
-    ws.merge_cells("A2:B2")
+    # Add clause data with wrap text and alternating row colors; rows are
+    # 80 high for readability
+    for row_idx, clause in enumerate(clauses, 1):
+        row_format = formats["alt_row"] if row_idx % 2 == 1 else formats["row"]
+        ws.set_row(row_idx, 80)
+        ws.write_row(row_idx, 0, [format_list(clause.get(field, "")) for field in CLAUSE_FIELDS], row_format)
 
-    # Headers
-    ws["A4"] = "Topic"
-    ws["B4"] = "Hard Limit (Do Not Accept Without Executive Approval)"
-    ws["A4"].font = HEADER_FONT
-    ws["B4"].font = HEADER_FONT
-    ws["A4"].fill = HEADER_FILL
-    ws["B4"].fill = HEADER_FILL
-    ws["A4"].border = THIN_BORDER
-    ws["B4"].border = THIN_BORDER
 
-    # Data
-    for row_idx, item in enumerate(quick_reference, 5):
-        issue_cell = ws.cell(row=row_idx, column=1, value=item.get("issue", ""))
-        limit_cell = ws.cell(row=row_idx, column=2, value=item.get("limit", ""))
-        issue_cell.alignment = WRAP_ALIGNMENT
-        limit_cell.alignment = WRAP_ALIGNMENT
-        issue_cell.border = THIN_BORDER
-        limit_cell.border = THIN_BORDER
-        if row_idx % 2 == 0:
-            issue_cell.fill = ALT_ROW_FILL
-            limit_cell.fill = ALT_ROW_FILL
+def create_quick_reference_sheet(wb: xlsxwriter.Workbook, formats: dict, quick_reference: list):
+    """Create the Quick Reference sheet with hard limits."""
+    ws = wb.add_worksheet("Quick Reference")
 
     # Column widths
-    ws.column_dimensions["A"].width = 30
-    ws.column_dimensions["B"].width = 70
+    ws.set_column(0, 0, 30)
+    ws.set_column(1, 1, 70)
 
     # Freeze header
-    ws.freeze_panes = "A5"
+    ws.freeze_panes(4, 0)
+
+    # Title
+    ws.merge_range(0, 0, 0, 1, "Quick Reference - Hard Limits", formats["subtitle"])
+    ws.merge_range(1, 0, 1, 1, "Items below require executive approval before deviating from standard position",
+                   formats["note"])
+
+    # Headers
+    ws.write_row(3, 0, ["Topic", "Hard Limit (Do Not Accept Without Executive Approval)"], formats["header"])
+
+    # Data
+    for row_idx, item in enumerate(quick_reference, 4):
+        row_format = formats["alt_row"] if row_idx % 2 == 1 else formats["row"]
+        ws.write_row(row_idx, 0, [item.get("issue", ""), item.get("limit", "")], row_format)
@@ -0,0 +1,155 @@
+"""
+Playbook generation pipeline: parse document, analyze with AI, write Excel.
+
+Runs inline in the web process by default, or on an RQ worker when
+REDIS_URL is configured (start one with `rq worker playbooks`).
+"""
+import os
+
+import config
+from utils.document_parser import parse_document
+from utils.playbook_common import prompt_fingerprint
+from utils.playbook_generator import analyze_contract_chunked
+from utils.excel_writer import generate_playbook_excel
+from utils.llm_cache import (
+    make_options_key, make_cache_key, get_cached_playbook, set_cached_playbook,
+    embed_contract, find_similar_playbook, add_semantic_entry
+)
+
+# Documents with less text than this (e.g. scans with only page numbers or a
+# stray header extracted) are rejected before any AI request is made
+MIN_CONTRACT_CHARS = 200
+
+
+def shared_upload_path(file_path: str) -> str:
+    """Return the <sha256>.<ext> lookup link for a job's <sha256>-<job_id>.<ext> upload."""
+    folder, name = os.path.split(file_path)
+    stem, extension = os.path.splitext(name)
+    return os.path.join(folder, stem.split("-", 1)[0] + extension)
+
+
+def run_playbook(
+    job_id: str,
+    file_path: str,
+    original_filename: str,
+    agreement_type: str = "General Agreement",
+    user_role: str = "Customer",
+    risk_tolerance: str = "Moderate",
+    progress_callback=None
+) -> dict:
+    """
+    Generate a playbook for an uploaded agreement.
+
+    Returns:
+        dict with 'output_path' and 'output_filename'
+    """
+    def update_progress(progress, message):
+        if progress_callback:
+            progress_callback(progress, message)
+
+    # Step 1: Parse document
+    update_progress(10, "Parsing document...")
+    if not os.path.exists(file_path):
+        # An RQ worker reads uploads from the web host's UPLOAD_FOLDER
+        raise FileNotFoundError(
+            f"Upload {os.path.basename(file_path)} not found. RQ workers must share the uploads, "
+            "output and cache directories with the web server."
+        )
+    try:
+        doc_data = parse_document(file_path)
+    finally:
+        # Uploaded contracts are confidential, so this job's link to the file
+        # (see _store_upload in app.py) is removed as soon as it is parsed,
+        # along with the lookup link once no other job holds the content
+        try:
+            os.remove(file_path)
+            shared_path = shared_upload_path(file_path)
+            if os.stat(shared_path).st_nlink == 1:
+                os.remove(shared_path)
+        except OSError:
+            pass
+
+    if not doc_data.get("text"):
+        raise ValueError("Could not extract text from the document. Please ensure it's not a scanned image.")
+    if len(doc_data["text"].strip()) < MIN_CONTRACT_CHARS:
+        raise ValueError(
+            "The document contains too little text to analyze. Please ensure it's not a scanned image."
+        )
+
+    # Step 2: Analyze with AI (or reuse a cached analysis of the same contract)
+    if config.AI_PROVIDER == "openai":
+        models = config.OPENAI_MODEL
+    else:
+        models = f"{config.ANTHROPIC_MODEL}+{config.ANTHROPIC_FAST_MODEL}"
+    options_key = make_options_key(agreement_type, user_role, risk_tolerance, f"{models}|{prompt_fingerprint()}")
+    cache_key = make_cache_key(doc_data["text"], options_key)
+    playbook_data = get_cached_playbook(cache_key)
+
+    # The semantic tier is an optimization: if the embedding request or the
+    # index fails, analyze the contract as if it were disabled
+    embedding = None
+    if playbook_data is None and config.SEMANTIC_CACHE_ENABLED:
+        try:
+            embedding = embed_contract(doc_data["text"])
+            playbook_data = find_similar_playbook(embedding, options_key)
+        except Exception as e:
+            print(f"Error checking semantic cache: {e}")
+            embedding = None
+            playbook_data = None
+
+    if playbook_data is None:
+        update_progress(20, "Analyzing contract with AI...")
+        playbook_data = analyze_contract_chunked(
+            contract_text=doc_data["text"],
+            agreement_type=agreement_type,
+            user_role=user_role,
+            risk_tolerance=risk_tolerance,
+            progress_callback=lambda p, m: update_progress(20 + int(p * 0.6), m)
+        )
+        # Don't cache a run where any topic analysis failed, so a re-run
+        # retries it instead of reusing the incomplete playbook
+        if playbook_data.get("topics") and not playbook_data.get("failed_topics"):
+            set_cached_playbook(cache_key, playbook_data)
+            if embedding is not None:
+                try:
+                    add_semantic_entry(embedding, options_key, cache_key)
+                except Exception as e:
+                    print(f"Error updating semantic cache: {e}")
+    else:
+        update_progress(80, "Reusing previous analysis of this contract...")
+
+    # Step 3: Generate Excel
+    update_progress(85, "Generating Excel playbook...")
+    output_filename = f"Playbook_{original_filename.rsplit('.', 1)[0]}_{job_id[:8]}.xlsx"
+    output_path = os.path.join(config.OUTPUT_FOLDER, output_filename)
+    generate_playbook_excel(playbook_data, output_path)
+
+    return {
+        "output_path": output_path,
+        "output_filename": output_filename
+    }
+
+
+def run_playbook_job(**kwargs) -> dict:
+    """
+    RQ entry point for run_playbook.
+
+    Progress and errors are written to the job's meta so the web process
+    can report them from /api/status.
+    """
+    from rq import get_current_job
+
+    job = get_current_job()
+
+    def update_progress(progress, message):
+        job.meta["progress"] = progress
+        job.meta["message"] = message
+        job.save_meta()
+
+    try:
+        return run_playbook(progress_callback=update_progress, **kwargs)
+    except Exception as e:
+        job.meta["error"] = str(e)
+        job.meta["message"] = f"Error: {str(e)}"
+        job.save_meta()
+        raise
@@ -0,0 +1,183 @@
+"""
+Persistent cache for AI playbook analysis results.
+
+Analysis is by far the slowest and most expensive step, so results are stored
+on disk keyed by a hash of the contract text, the analysis options and the
+model. Re-running the same contract with the same options skips the AI calls.
+Entries are gzip-compressed JSON; playbooks repeat the same keys and phrasing
+across clauses and shrink several-fold.
+
+An optional semantic tier (SEMANTIC_CACHE=1) catches near-duplicates, such as
+the same template with different party names or dates, by comparing OpenAI
+embeddings of the normalized contract text against previously analyzed ones.
+"""
+import gzip
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: no RQ workers there, so one process writes the index
+    fcntl = None
+
+import config
+
+# gzip level for cache entries: close to level 9's size at a fraction of the time
+CACHE_COMPRESSLEVEL = 6
+
+# Semantic index file in CACHE_FOLDER. Everything else there is a playbook
+# entry or a temp file and is swept once older than PLAYBOOK_CACHE_TTL.
+SEMANTIC_INDEX_FILE = "semantic_index.npz"
+SEMANTIC_LOCK_FILE = "semantic_index.lock"
+CACHE_KEEP_FILES = frozenset({SEMANTIC_INDEX_FILE, SEMANTIC_LOCK_FILE})
+
+# Characters of normalized contract text sent to the embedding model
+EMBEDDING_INPUT_CHARS = 8000
+
+_semantic_lock = threading.Lock()
+
+
+def make_options_key(agreement_type: str, user_role: str, risk_tolerance: str, model: str) -> str:
+    """Identify the analysis options a cached playbook was generated with."""
+    return f"{model}|{agreement_type}|{user_role}|{risk_tolerance}"
+
+
+def make_cache_key(contract_text: str, options_key: str) -> str:
+    """Build the cache key for an analysis request."""
+    h = hashlib.sha256(f"{options_key}|".encode())
+    h.update(contract_text.encode())
+    return h.hexdigest()
+
+
+def _cache_path(key: str) -> str:
+    return os.path.join(config.CACHE_FOLDER, f"{key}.json.gz")
+
+
+def get_cached_playbook(key: str):
+    """Return the cached playbook for a key, or None on a miss or if it has expired."""
+    if not config.PLAYBOOK_CACHE_ENABLED:
+        return None
+    path = _cache_path(key)
+    try:
+        # Expired entries are a miss even before the cleanup sweep removes them
+        if time.time() - os.path.getmtime(path) > config.PLAYBOOK_CACHE_TTL:
+            return None
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, EOFError, ValueError):
+        return None
+
+
+def set_cached_playbook(key: str, playbook_data: dict):
+    """Store a playbook under a key, replacing any existing entry atomically."""
+    if not config.PLAYBOOK_CACHE_ENABLED:
+        return
+    data = gzip.compress(json.dumps(playbook_data).encode("utf-8"), compresslevel=CACHE_COMPRESSLEVEL)
+    with tempfile.NamedTemporaryFile(dir=config.CACHE_FOLDER, suffix=".tmp", delete=False) as f:
+        f.write(data)
+    os.replace(f.name, _cache_path(key))
+
+
+def _index_path() -> str:
+    return os.path.join(config.CACHE_FOLDER, SEMANTIC_INDEX_FILE)
+
+
+@contextmanager
+def _semantic_index_lock():
+    """
+    Hold the semantic index for a load-modify-replace update.
+
+    _semantic_lock serializes threads in this process; an flock on a sidecar
+    file serializes the web process and RQ workers, which would otherwise
+    each append to their own copy and overwrite one another's entries.
+    """
+    with _semantic_lock:
+        if fcntl is None:
+            yield
+            return
+        with open(os.path.join(config.CACHE_FOLDER, SEMANTIC_LOCK_FILE), "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _load_index():
+    """Load (vectors, cache_keys, options_keys) from disk, or None if empty."""
+    import numpy as np
+
+    try:
+        with np.load(_index_path()) as data:
+            return data["vectors"], list(data["cache_keys"]), list(data["options_keys"])
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def embed_contract(contract_text: str):
+    """
+    Embed the normalized start of a contract for similarity lookup.
+
+    Returns a unit-length numpy vector so inner product equals cosine similarity.
+    """
+    import numpy as np
+    from utils.playbook_generator_openai import get_openai_client
+
+    normalized = re.sub(r"\s+", " ", contract_text).strip().lower()[:EMBEDDING_INPUT_CHARS]
+    client = get_openai_client()
+    response = client.embeddings.create(model=config.EMBEDDING_MODEL, input=normalized)
+    vector = np.asarray(response.data[0].embedding, dtype=np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+def find_similar_playbook(embedding, options_key: str):
+    """
+    Return the cached playbook most similar to an embedding, if it was
+    generated with the same options and clears SEMANTIC_CACHE_THRESHOLD.
+    """
+    import numpy as np
+
+    with _semantic_lock:
+        index = _load_index()
+    if index is None:
+        return None
+
+    vectors, cache_keys, options_keys = index
+    mask = np.asarray(options_keys) == options_key
+    if not mask.any():
+        return None
+
+    scores = np.where(mask, vectors @ embedding, -1.0)
+    best = int(np.argmax(scores))
+    if scores[best] < config.SEMANTIC_CACHE_THRESHOLD:
+        return None
+    return get_cached_playbook(cache_keys[best])
+
+
+def add_semantic_entry(embedding, options_key: str, cache_key: str):
+    """Record a cached playbook's embedding so later near-duplicates can find it."""
+    import numpy as np
+
+    with _semantic_index_lock():
+        index = _load_index()
+        if index is None:
+            vectors = embedding[np.newaxis, :]
+            cache_keys, options_keys = [cache_key], [options_key]
+        else:
+            vectors, cache_keys, options_keys = index
+            # Drop rows whose playbook has since been swept from the cache
+            keep = [os.path.exists(_cache_path(key)) for key in cache_keys]
+            vectors = np.vstack([vectors[keep], embedding])
+            cache_keys = [key for key, kept in zip(cache_keys, keep) if kept] + [cache_key]
+            options_keys = [key for key, kept in zip(options_keys, keep) if kept] + [options_key]
+
+        with tempfile.NamedTemporaryFile(dir=config.CACHE_FOLDER, suffix=".npz", delete=False) as f:
+            np.savez(f, vectors=vectors, cache_keys=np.asarray(cache_keys),
+                     options_keys=np.asarray(options_keys))
+        os.replace(f.name, _index_path())
@@ -0,0 +1,330 @@
+"""
+Prompts, output schemas and playbook assembly shared by the AI backends.
+
+playbook_generator.py (Claude) and playbook_generator_openai.py (OpenAI) send
+the same prompts and build the same playbook structure from them, so the rest
+of the app doesn't depend on the provider.
+"""
+import hashlib
+import json
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import config
+
+
+# Characters of contract text sent with each request
+CONTRACT_CHARS = 80000
+
+# Seconds between status checks while waiting for a batch to finish
+BATCH_POLL_INTERVAL = 15
+
+# Topics analyzed for each contract, with the focus given to the model
+TOPICS_TO_ANALYZE = (
+    ("Definitions", "definitions, defined terms, and interpretation provisions"),
+    ("Solution/Services", "the solution, services, platform, software, or product being provided"),
+    ("Licenses & Restrictions", "license grants, usage rights, restrictions, and permitted uses"),
+    ("Proprietary Rights/IP", "intellectual property, ownership, proprietary rights, and IP assignments"),
+    ("Financial Terms", "fees, payment terms, pricing, invoicing, and financial obligations"),
+    ("Confidentiality", "confidentiality, non-disclosure, and information protection"),
+    ("Data Security & Privacy", "data protection, security, privacy, data processing, and compliance"),
+    ("Warranties", "representations, warranties, disclaimers, and guarantees"),
+    ("Indemnification", "indemnification, defense, and hold harmless provisions"),
+    ("Limitation of Liability", "liability caps, exclusions, consequential damages, and limitations"),
+    ("Term & Termination", "term, renewal, termination rights, and effects of termination"),
+    ("General Provisions", "miscellaneous provisions like assignment, notices, force majeure, amendments"),
+    ("Exhibits & Schedules", "exhibits, schedules, appendices, and attachments")
+)
+
+# Output token cap per topic. Responses cut off at the cap lose their JSON, so
+# caps stay well above typical output; they bound worst-case generation time.
+DEFAULT_TOPIC_MAX_TOKENS = 6144
+TOPIC_MAX_TOKENS = {
+    "Definitions": 4096,
+    "Solution/Services": 4096,
+    "Confidentiality": 4096,
+    "General Provisions": 4096,
+    "Exhibits & Schedules": 4096,
+    "Indemnification": 8192,
+    "Limitation of Liability": 8192,
+}
+
+# Output schemas. The field descriptions are the model's formatting
+# instructions, so the prompts don't repeat an example of the structure.
+# Claude returns each analysis as the input of a forced tool call, and OpenAI
+# uses the same schemas for structured outputs.
+CLAUSE_FIELDS = {
+    "section": "Section number (e.g., '2.1', 'III', 'Schedule A')",
+    "subsection": "Subsection if applicable",
+    "issue": "Brief title describing the specific issue",
+    "current_language": "EXACT quoted text from the contract",
+    "purpose_rationale": "Why this clause exists and its business purpose",
+    "customer_concerns": "What customers worry about, as bullet points ('• ' prefix, one per line)",
+    "customer_edits_to_watch": "Edits customers typically request, as bullet points",
+    "provider_position": "The provider's perspective and what they need to protect",
+    "acceptable_modifications": "Standard negotiation moves that can be accepted, as bullet points",
+    "fallback_language": "Ready-to-use alternative contract language",
+    "do_not_accept": "Hard limits that must not be accepted, as bullet points",
+    "notes": "Additional considerations or context",
+}
+OVERVIEW_TOOL = {
+    "name": "record_overview",
+    "description": "Record the overview of the agreement.",
+    "input_schema": {
+        "type": "object",
+        "properties": {
+            "title": {"type": "string", "description": "Full title of the agreement"},
+            "parties": {"type": "string", "description": "Description of the parties"},
+            "effective_date": {"type": "string", "description": "If specified"},
+            "governing_law": {"type": "string", "description": "Jurisdiction if specified"},
+            "key_principles": {
+                "type": "array", "items": {"type": "string"},
+                "description": "Four or more key principles about this agreement"
+            },
+            "executive_summary": {
+                "type": "string",
+                "description": "2-3 paragraph overview of the agreement and key negotiation considerations"
+            },
+            "sections_found": {
+                "type": "array", "items": {"type": "string"},
+                "description": "Major sections/topics found in the contract"
+            },
+        },
+        "required": ["title", "key_principles", "executive_summary"],
+    },
+}
+TOPIC_TOOL = {
+    "name": "record_topic_analysis",
+    "description": "Record the clause analysis and hard limits for one contract topic.",
+    "input_schema": {
+        "type": "object",
+        "properties": {
+            "topic": {"type": "string"},
+            "clauses": {
+                "type": "array",
+                "description": "One entry per relevant clause or provision, including important omissions",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        field: {"type": "string", "description": description}
+                        for field, description in CLAUSE_FIELDS.items()
+                    },
+                    "required": ["section", "issue", "current_language"],
+                },
+            },
+            "hard_limits": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "issue": {"type": "string", "description": "Brief description"},
+                        "limit": {"type": "string", "description": "What requires executive approval"},
+                    },
+                    "required": ["issue", "limit"],
+                },
+            },
+        },
+        "required": ["clauses", "hard_limits"],
+    },
+}
+
+
+# Sent ahead of the contract in every request and covered by both providers'
+# prompt caches along with the tools. Keep it static: interpolating anything
+# per-request (dates, names, IDs) would make every request a cache miss.
+SYSTEM_PROMPT = """You are an expert contract attorney with 25+ years of experience creating comprehensive contract playbooks for Fortune 500 companies. You analyze contracts with extraordinary depth and practical insight.
+
+Your analysis must be:
+1. THOROUGH - Every significant clause gets detailed treatment
+2. PRACTICAL - Real negotiation guidance, not academic analysis
+3. BALANCED - Both customer and provider perspectives
+4. ACTIONABLE - Ready-to-use fallback language and hard limits
+
+For each clause you analyze, provide:
+- The exact contract language (quoted)
+- Why this clause exists and matters (business context)
+- What customers typically want to change
+- What providers need to protect
+- Specific acceptable modifications
+- Ready-to-use fallback language
+- Clear "do not accept" boundaries"""
+
+
+# Parses one JSON value from a position in a string, leaving any trailing text
+_JSON_DECODER = json.JSONDecoder()
+
+
+def extract_json(text: str):
+    """
+    Return the JSON object in a model response, or None.
+
+    Responses are usually bare JSON but may be wrapped in prose or a code
+    fence, which raw_decode handles by parsing from the first brace and
+    ignoring whatever follows the object. Only that outermost object is
+    tried: if it is malformed or truncated the response has no usable
+    result, and scanning into it could return a nested fragment (e.g. a
+    single clause) as if it were the whole analysis.
+    """
+    try:
+        result = json.loads(text)
+        if isinstance(result, dict):
+            return result
+    except ValueError:
+        pass
+
+    start = text.find("{")
+    if start == -1:
+        return None
+    try:
+        return _JSON_DECODER.raw_decode(text, start)[0]
+    except ValueError:
+        return None
+
+
+def contract_excerpt(contract_text: str) -> str:
+    """
+    The contract text sent with each request, at most CONTRACT_CHARS long.
+
+    Longer contracts are cut at the last paragraph break before the limit
+    rather than mid-sentence, so the model never sees a half-quoted clause.
+    """
+    if len(contract_text) <= CONTRACT_CHARS:
+        return contract_text
+    cut = contract_text.rfind("\n\n", CONTRACT_CHARS // 2, CONTRACT_CHARS)
+    if cut == -1:
+        cut = contract_text.rfind("\n", CONTRACT_CHARS // 2, CONTRACT_CHARS)
+    return contract_text[:cut if cut != -1 else CONTRACT_CHARS]
+
+
+def overview_prompt(agreement_type: str, user_role: str, risk_tolerance: str) -> str:
+    """Instructions for the agreement overview (sent after the contract text)."""
+    return f"""Analyze this contract and provide a comprehensive overview.
+
+CONTEXT:
+- Agreement Type: {agreement_type}
+- Analyzing from: {user_role} perspective
+- Risk Tolerance: {risk_tolerance}
+
+Provide your analysis in the record_overview format."""
+
+
+def overview_or_default(overview, agreement_type: str) -> dict:
+    """Return the parsed overview, or a minimal one if none could be parsed."""
+    if overview is None:
+        return {"title": agreement_type, "key_principles": [], "executive_summary": ""}
+    return overview
+
+
+def topic_prompt(
+    topic_name: str,
+    topic_description: str,
+    agreement_type: str,
+    user_role: str,
+    risk_tolerance: str
+) -> str:
+    """Instructions for one contract topic (sent after the contract text)."""
+    return f"""Analyze this contract focusing specifically on {topic_description}.
+
+CONTEXT:
+- Agreement Type: {agreement_type}
+- Analyzing from: {user_role} perspective
+- Risk Tolerance: {risk_tolerance}
+
+For each relevant clause or provision related to {topic_name}, provide detailed analysis in the record_topic_analysis format.
+
+Be thorough - analyze EVERY clause related to {topic_name}. Include both explicit provisions AND important omissions that should be addressed."""
+
+
+def build_playbook(overview: dict, topic_results: dict, agreement_type: str, user_role: str) -> dict:
+    """Assemble the playbook from the overview and per-topic analysis results."""
+    # Collect results in topic order so sheets keep a stable order
+    all_topics = {}
+    quick_reference = []
+    failed_topics = []
+    for topic_name, _ in TOPICS_TO_ANALYZE:
+        topic_data = topic_results.get(topic_name)
+        if topic_data is None:
+            # The request failed after retries, or returned no analysis
+            failed_topics.append(topic_name)
+            continue
+        if topic_data.get("clauses"):
+            all_topics[topic_name] = topic_data["clauses"]
+        if topic_data.get("hard_limits"):
+            quick_reference.extend(topic_data["hard_limits"])
+
+    # Build the final playbook structure
+    return {
+        "overview": {
+            "title": overview.get("title", agreement_type),
+            "agreement_type": agreement_type,
+            "perspective": user_role,
+            "parties": overview.get("parties", ""),
+            "effective_date": overview.get("effective_date", ""),
+            "governing_law": overview.get("governing_law", ""),
+            "key_principles": overview.get("key_principles", []),
+            "executive_summary": overview.get("executive_summary", ""),
+            "how_to_use": [
+                "Navigate to the relevant section tab based on the clause being negotiated",
+                "Review the 'Purpose/Rationale' to understand why the clause exists",
+                "Check 'Customer Concerns' or 'Provider Position' based on your role",
+                "Use 'Acceptable Modifications' for standard negotiation moves",
+                "Reference 'Fallback Language' when proposing alternatives",
+                "Never accept terms listed in 'Do Not Accept' without executive approval"
+            ]
+        },
+        "topics": all_topics,
+        "quick_reference": quick_reference,
+        "failed_topics": failed_topics
+    }
+
+
+def prompt_fingerprint() -> str:
+    """
+    Short hash of the prompts, tools and limits that shape every analysis.
+
+    Part of the playbook cache key, so editing a prompt invalidates playbooks
+    generated with the old one instead of serving them indefinitely.
+    """
+    prompts = [
+        SYSTEM_PROMPT, [OVERVIEW_TOOL, TOPIC_TOOL], TOPICS_TO_ANALYZE, TOPIC_MAX_TOKENS,
+        DEFAULT_TOPIC_MAX_TOKENS, CONTRACT_CHARS, overview_prompt("", "", ""), topic_prompt("", "", "", "", ""),
+    ]
+    return hashlib.sha256(json.dumps(prompts).encode()).hexdigest()[:16]
+
+
+def analyze_concurrently(analyze_overview, analyze_topic, progress_callback=None) -> tuple:
+    """
+    Run the overview and per-topic analyses concurrently.
+
+    The overview and the per-topic analyses are independent requests, so they
+    run up to AI_CONCURRENCY at a time rather than one by one. A topic that
+    still fails after the client's retries is reported and left out of
+    topic_results; a failed overview raises.
+
+    Args:
+        analyze_overview: Callable returning the overview dict
+        analyze_topic: Callable (topic_name, topic_description) returning the
+            parsed topic JSON or None
+
+    Returns:
+        (overview, topic_results) where topic_results maps topic name to result
+    """
+    topic_results = {}
+    with ThreadPoolExecutor(max_workers=config.AI_CONCURRENCY) as executor:
+        overview_future = executor.submit(analyze_overview)
+        topic_futures = {
+            executor.submit(analyze_topic, topic_name, topic_description): topic_name
+            for topic_name, topic_description in TOPICS_TO_ANALYZE
+        }
+
+        for done, future in enumerate(as_completed(topic_futures), 1):
+            topic_name = topic_futures[future]
+            try:
+                topic_results[topic_name] = future.result()
+            except Exception as e:
+                print(f"Error analyzing {topic_name}: {e}")
+
+            if progress_callback:
+                progress = 15 + int((done / len(TOPICS_TO_ANALYZE)) * 70)
+                progress_callback(progress, f"Analyzed {topic_name} ({done}/{len(TOPICS_TO_ANALYZE)} topics)")
+
+        return overview_future.result(), topic_results
@@ -3,57 +3,172 @@ AI-powered playbook generation using Claude API.
 
 This module generates comprehensive contract playbooks with detailed analysis
 matching professional legal playbook standards, organized by contract topic.
+The prompts, JSON extraction and playbook assembly live in playbook_common.py,
+shared with the OpenAI backend in playbook_generator_openai.py.
 """
-import json
-import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from anthropic import Anthropic
 import config
+from utils.playbook_common import (
+    BATCH_POLL_INTERVAL, DEFAULT_TOPIC_MAX_TOKENS, OVERVIEW_TOOL, SYSTEM_PROMPT, TOPIC_MAX_TOKENS, TOPIC_TOOL,
+    TOPICS_TO_ANALYZE, analyze_concurrently, build_playbook, contract_excerpt, overview_or_default,
+    overview_prompt, topic_prompt
+)
 
 
+@lru_cache(maxsize=1)
 def get_anthropic_client():
-    """Get Anthropic client with API key from config."""
+    """
+    Get Anthropic client with API key from config.
+
+    One client is shared by every analysis in the process so its connection
+    pool (and the TLS sessions in it) are reused across contracts.
+    """
     api_key = config.ANTHROPIC_API_KEY
     if not api_key:
         raise ValueError(
             "Anthropic API key not found. Please set the ANTHROPIC_API_KEY environment variable."
         )
-    return Anthropic(api_key=api_key)
-
-
-# Contract topic categories for organizing the playbook
-CONTRACT_TOPICS = [
-    "Definitions",
-    "Solution/Services",
-    "Licenses & Restrictions",
-    "Proprietary Rights/IP",
-    "Financial Terms",
-    "Confidentiality",
-    "Data Security & Privacy",
-    "Warranties",
-    "Indemnification",
-    "Limitation of Liability",
-    "Term & Termination",
-    "General Provisions",
-    "Exhibits & Schedules"
-]
-
-
-SYSTEM_PROMPT = """You are an expert contract attorney with 25+ years of experience creating comprehensive contract playbooks for Fortune 500 companies. You analyze contracts with extraordinary depth and practical insight.
-
-Your analysis must be:
-1. THOROUGH - Every significant clause gets detailed treatment
-2. PRACTICAL - Real negotiation guidance, not academic analysis
-3. BALANCED - Both customer and provider perspectives
-4. ACTIONABLE - Ready-to-use fallback language and hard limits
-
-For each clause you analyze, provide:
-- The exact contract language (quoted)
-- Why this clause exists and matters (business context)
-- What customers typically want to change
-- What providers need to protect
-- Specific acceptable modifications
-- Ready-to-use fallback language
-- Clear "do not accept" boundaries"""
+    # The SDK retries 429/529/5xx responses and timeouts with exponential
+    # backoff and jitter, honoring the Retry-After header
+    return Anthropic(api_key=api_key, max_retries=config.AI_MAX_RETRIES)
+
+
+# Largely extractive topics, analyzed with ANTHROPIC_FAST_MODEL
+FAST_TOPICS = frozenset({"Definitions", "Exhibits & Schedules"})
+
+# Every request sends both tools: tool definitions are part of the cached
+# prompt prefix, so they must be identical across requests
+TOOLS = [OVERVIEW_TOOL, TOPIC_TOOL]
+
+
+def _contract_block(contract_text: str) -> dict:
+    """
+    The contract as a prompt-cached content block.
+
+    Every request sends the same system prompt followed by this block, so after
+    the first request the shared prefix is read from Anthropic's prompt cache
+    instead of being processed (and billed) in full again.
+    """
+    return {
+        "type": "text",
+        "text": f"CONTRACT TEXT:\n{contract_excerpt(contract_text)}",
+        "cache_control": {"type": "ephemeral"}
+    }
+
+
+def _warm_prompt_cache(client: Anthropic, contract_text: str, model: str):
+    """
+    Write the system prompt + contract prefix to the prompt cache.
+
+    Requests sent at the same moment can't read a cache entry none of them has
+    written yet, so one minimal request goes first before the fan-out. It uses
+    the topic requests' tool_choice, since changing tool_choice invalidates
+    cached message blocks.
+    """
+    try:
+        client.messages.create(
+            model=model,
+            max_tokens=1,
+            messages=[{"role": "user", "content": [_contract_block(contract_text)]}],
+            system=SYSTEM_PROMPT,
+            tools=TOOLS,
+            tool_choice={"type": "tool", "name": TOPIC_TOOL["name"]}
+        )
+    except Exception as e:
+        print(f"Error warming prompt cache: {e}")
+
+
+def _overview_request(
+    contract_text: str,
+    agreement_type: str,
+    user_role: str,
+    risk_tolerance: str
+) -> dict:
+    """Build the messages.create parameters for the agreement overview."""
+    prompt = overview_prompt(agreement_type, user_role, risk_tolerance)
+    return {
+        "model": config.ANTHROPIC_FAST_MODEL,
+        "max_tokens": 4096,
+        "messages": [
+            {"role": "user", "content": [_contract_block(contract_text), {"type": "text", "text": prompt}]}
+        ],
+        "system": SYSTEM_PROMPT,
+        "tools": TOOLS,
+        "tool_choice": {"type": "tool", "name": OVERVIEW_TOOL["name"]}
+    }
+
+
+def _tool_input(message):
+    """Return the input of the tool call in a response message, or None."""
+    for block in message.content:
+        if block.type == "tool_use":
+            return block.input
+    return None
+
+
+def _parse_overview(message, agreement_type: str) -> dict:
+    """Extract the overview from a response message, with a fallback."""
+    return overview_or_default(_tool_input(message), agreement_type)
+
+
+def _analyze_overview(
+    client: Anthropic,
+    contract_text: str,
+    agreement_type: str,
+    user_role: str,
+    risk_tolerance: str
+) -> dict:
+    """Get the agreement overview (title, parties, key principles, summary)."""
+    response = client.messages.create(
+        **_overview_request(contract_text, agreement_type, user_role, risk_tolerance)
+    )
+    return _parse_overview(response, agreement_type)
+
+
+def _topic_request(
+    topic_name: str,
+    topic_description: str,
+    contract_text: str,
+    agreement_type: str,
+    user_role: str,
+    risk_tolerance: str
+) -> dict:
+    """Build the messages.create parameters for one contract topic."""
+    prompt = topic_prompt(topic_name, topic_description, agreement_type, user_role, risk_tolerance)
+    return {
+        "model": config.ANTHROPIC_FAST_MODEL if topic_name in FAST_TOPICS else config.ANTHROPIC_MODEL,
+        "max_tokens": TOPIC_MAX_TOKENS.get(topic_name, DEFAULT_TOPIC_MAX_TOKENS),
+        "messages": [
+            {"role": "user", "content": [_contract_block(contract_text), {"type": "text", "text": prompt}]}
+        ],
+        "system": SYSTEM_PROMPT,
+        "tools": TOOLS,
+        "tool_choice": {"type": "tool", "name": TOPIC_TOOL["name"]}
+    }
+
+
+def _parse_topic(message):
+    """Extract the topic analysis from a response message. Returns None if absent."""
+    return _tool_input(message)
+
+
+def _analyze_topic(
+    client: Anthropic,
+    topic_name: str,
+    topic_description: str,
+    contract_text: str,
+    agreement_type: str,
+    user_role: str,
+    risk_tolerance: str
+):
+    """Analyze one contract topic. Returns the parsed topic JSON, or None."""
+    response = client.messages.create(
+        **_topic_request(topic_name, topic_description, contract_text, agreement_type, user_role, risk_tolerance)
+    )
+    return _parse_topic(response)
 
 
 def analyze_contract_with_claude(
@@ -73,170 +188,102 @@ def analyze_contract_with_claude(
     if progress_callback:
         progress_callback(5, "Preparing contract analysis...")
 
-    # First, get the overview and identify key sections
-    overview_prompt = f"""Analyze this contract and provide a comprehensive overview.
-
-CONTRACT TEXT:
-{contract_text[:50000]}
-
-CONTEXT:
-- Agreement Type: {agreement_type}
-- Analyzing from: {user_role} perspective
-- Risk Tolerance: {risk_tolerance}
-
-Provide your analysis as JSON with this structure:
-{{
-    "title": "Full title of the agreement",
-    "parties": "Description of the parties",
-    "effective_date": "If specified",
-    "governing_law": "Jurisdiction if specified",
-    "key_principles": [
-        "Key principle 1 about this agreement",
-        "Key principle 2",
-        "Key principle 3",
-        "Key principle 4"
-    ],
-    "executive_summary": "2-3 paragraph overview of the agreement and key negotiation considerations",
-    "sections_found": ["List of major sections/topics found in the contract"]
-}}"""
-
     if progress_callback:
         progress_callback(10, "Analyzing agreement structure...")
 
-    overview_response = client.messages.create(
-        model=config.ANTHROPIC_MODEL,
-        max_tokens=4096,
-        messages=[
-            {"role": "user", "content": overview_prompt}
-        ],
-        system=SYSTEM_PROMPT
+    # Prompt caches are per model, so each model in use gets its own warm-up
+    models = {config.ANTHROPIC_MODEL, config.ANTHROPIC_FAST_MODEL}
+    with ThreadPoolExecutor(max_workers=len(models)) as executor:
+        list(executor.map(lambda model: _warm_prompt_cache(client, contract_text, model), models))
+
+    overview, topic_results = analyze_concurrently(
+        lambda: _analyze_overview(client, contract_text, agreement_type, user_role, risk_tolerance),
+        lambda topic_name, topic_description: _analyze_topic(
+            client, topic_name, topic_description, contract_text, agreement_type, user_role, risk_tolerance
+        ),
+        progress_callback
     )
 
-    try:
-        overview_text = overview_response.content[0].text
-        # Extract JSON from response
-        json_match = re.search(r'\{[\s\S]*\}', overview_text)
-        if json_match:
-            overview = json.loads(json_match.group())
-        else:
-            overview = {"title": agreement_type, "key_principles": [], "executive_summary": ""}
-    except (json.JSONDecodeError, IndexError):
-        overview = {"title": agreement_type, "key_principles": [], "executive_summary": ""}
-
-    # Analyze each topic area
-    all_topics = {}
-    quick_reference = []
-
-    topics_to_analyze = [
-        ("Definitions", "definitions, defined terms, and interpretation provisions"),
-        ("Solution/Services", "the solution, services, platform, software, or product being provided"),
-        ("Licenses & Restrictions", "license grants, usage rights, restrictions, and permitted uses"),
-        ("Proprietary Rights/IP", "intellectual property, ownership, proprietary rights, and IP assignments"),
-        ("Financial Terms", "fees, payment terms, pricing, invoicing, and financial obligations"),
-        ("Confidentiality", "confidentiality, non-disclosure, and information protection"),
-        ("Data Security & Privacy", "data protection, security, privacy, data processing, and compliance"),
-        ("Warranties", "representations, warranties, disclaimers, and guarantees"),
-        ("Indemnification", "indemnification, defense, and hold harmless provisions"),
-        ("Limitation of Liability", "liability caps, exclusions, consequential damages, and limitations"),
-        ("Term & Termination", "term, renewal, termination rights, and effects of termination"),
-        ("General Provisions", "miscellaneous provisions like assignment, notices, force majeure, amendments"),
-        ("Exhibits & Schedules", "exhibits, schedules, appendices, and attachments")
-    ]
-
-    for idx, (topic_name, topic_description) in enumerate(topics_to_analyze):
-        if progress_callback:
-            progress = 15 + int((idx / len(topics_to_analyze)) * 70)
-            progress_callback(progress, f"Analyzing {topic_name}...")
-
-        topic_prompt = f"""Analyze this contract focusing specifically on {topic_description}.
-
-CONTRACT TEXT:
-{contract_text[:80000]}
-
-CONTEXT:
-- Agreement Type: {agreement_type}
-- Analyzing from: {user_role} perspective
-- Risk Tolerance: {risk_tolerance}
-
-For each relevant clause or provision related to {topic_name}, provide detailed analysis.
-
-Return JSON with this structure:
-{{
-    "topic": "{topic_name}",
-    "clauses": [
-        {{
-            "section": "Section number (e.g., '2.1', 'III', 'Schedule A')",
-            "subsection": "Subsection if applicable",
-            "issue": "Brief title describing the specific issue",
-            "current_language": "EXACT quoted text from the contract",
-            "purpose_rationale": "Why this clause exists and its business purpose",
-            "customer_concerns": "• Bullet point 1\\n• Bullet point 2\\n• Bullet point 3",
-            "customer_edits_to_watch": "• Edit 1\\n• Edit 2\\n• Edit 3",
-            "provider_position": "The provider's perspective and what they need to protect",
-            "acceptable_modifications": "• Modification 1\\n• Modification 2",
-            "fallback_language": "Ready-to-use alternative contract language",
-            "do_not_accept": "• Hard limit 1\\n• Hard limit 2",
-            "notes": "Additional considerations or context"
-        }}
-    ],
-    "hard_limits": [
-        {{
-            "issue": "Brief description",
-            "limit": "What requires executive approval"
-        }}
-    ]
-}}
-
-Be thorough - analyze EVERY clause related to {topic_name}. Include both explicit provisions AND important omissions that should be addressed."""
+    if progress_callback:
+        progress_callback(90, "Compiling playbook...")
 
-        try:
-            topic_response = client.messages.create(
-                model=config.ANTHROPIC_MODEL,
-                max_tokens=8192,
-                messages=[
-                    {"role": "user", "content": topic_prompt}
-                ],
-                system=SYSTEM_PROMPT
+    playbook = build_playbook(overview, topic_results, agreement_type, user_role)
+
+    if progress_callback:
+        progress_callback(100, "Analysis complete")
+
+    return playbook
+
+
+def analyze_contract_batched(
+    contract_text: str,
+    agreement_type: str = "General Agreement",
+    user_role: str = "Customer",
+    risk_tolerance: str = "Moderate",
+    progress_callback=None
+) -> dict:
+    """
+    Analyze contract through the Message Batches API.
+
+    Same requests and output as analyze_contract_with_claude, submitted as one
+    batch at half the token price. Batches can take minutes to hours to finish,
+    so this is only used when AI_BATCH=1.
+    """
+    client = get_anthropic_client()
+
+    if progress_callback:
+        progress_callback(5, "Submitting analysis batch...")
+
+    # Batch custom_ids only allow [a-zA-Z0-9_-], so topics are referenced by index
+    requests = [{
+        "custom_id": "overview",
+        "params": _overview_request(contract_text, agreement_type, user_role, risk_tolerance)
+    }]
+    for idx, (topic_name, topic_description) in enumerate(TOPICS_TO_ANALYZE):
+        requests.append({
+            "custom_id": f"topic-{idx}",
+            "params": _topic_request(
+                topic_name, topic_description, contract_text, agreement_type, user_role, risk_tolerance
             )
+        })
 
-            topic_text = topic_response.content[0].text
-            json_match = re.search(r'\{[\s\S]*\}', topic_text)
-            if json_match:
-                topic_data = json.loads(json_match.group())
-                if topic_data.get("clauses"):
-                    all_topics[topic_name] = topic_data["clauses"]
-                if topic_data.get("hard_limits"):
-                    quick_reference.extend(topic_data["hard_limits"])
-        except Exception as e:
-            print(f"Error analyzing {topic_name}: {e}")
+    batch = client.messages.batches.create(requests=requests)
+
+    while batch.processing_status != "ended":
+        time.sleep(BATCH_POLL_INTERVAL)
+        batch = client.messages.batches.retrieve(batch.id)
+        if progress_callback:
+            counts = batch.request_counts
+            done = counts.succeeded + counts.errored + counts.canceled + counts.expired
+            progress_callback(
+                10 + int((done / len(requests)) * 75),
+                f"Waiting for batch analysis ({done}/{len(requests)} requests done)..."
+            )
+
+    overview = {"title": agreement_type, "key_principles": [], "executive_summary": ""}
+    topic_results = {}
+    for entry in client.messages.batches.results(batch.id):
+        if entry.custom_id == "overview":
+            name = "overview"
+        else:
+            name = TOPICS_TO_ANALYZE[int(entry.custom_id.split("-", 1)[1])][0]
+
+        if entry.result.type != "succeeded":
+            print(f"Error analyzing {name}: batch request {entry.result.type}")
             continue
 
+        try:
+            if name == "overview":
+                overview = _parse_overview(entry.result.message, agreement_type)
+            else:
+                topic_results[name] = _parse_topic(entry.result.message)
+        except Exception as e:
+            print(f"Error analyzing {name}: {e}")
+
     if progress_callback:
         progress_callback(90, "Compiling playbook...")
 
-    # Build the final playbook structure
-    playbook = {
-        "overview": {
-            "title": overview.get("title", agreement_type),
-            "agreement_type": agreement_type,
-            "perspective": user_role,
-            "parties": overview.get("parties", ""),
-            "effective_date": overview.get("effective_date", ""),
-            "governing_law": overview.get("governing_law", ""),
-            "key_principles": overview.get("key_principles", []),
-            "executive_summary": overview.get("executive_summary", ""),
-            "how_to_use": [
-                "Navigate to the relevant section tab based on the clause being negotiated",
-                "Review the 'Purpose/Rationale' to understand why the clause exists",
-                "Check 'Customer Concerns' or 'Provider Position' based on your role",
-                "Use 'Acceptable Modifications' for standard negotiation moves",
-                "Reference 'Fallback Language' when proposing alternatives",
-                "Never accept terms listed in 'Do Not Accept' without executive approval"
-            ]
-        },
-        "topics": all_topics,
-        "quick_reference": quick_reference
-    }
+    playbook = build_playbook(overview, topic_results, agreement_type, user_role)
 
     if progress_callback:
         progress_callback(100, "Analysis complete")
@@ -252,11 +299,24 @@ def analyze_contract_chunked(
     progress_callback=None
 ) -> dict:
     """
-    Main entry point - routes to Claude API.
+    Main entry point - routes to the configured AI provider.
     Maintains backward compatibility with existing code.
     """
-    return analyze_contract_with_claude(
-        contract_text=contract_text,
+    if config.AI_PROVIDER == "openai":
+        # Imported lazily so the openai package only loads when it is used
+        from utils import playbook_generator_openai as openai_generator
+        if config.AI_BATCH_MODE:
+            analyze = openai_generator.analyze_contract_batched
+        else:
+            analyze = openai_generator.analyze_contract_with_openai
+    elif config.AI_BATCH_MODE:
+        analyze = analyze_contract_batched
+    else:
+        analyze = analyze_contract_with_claude
+    # Truncate once up front; every request then sends the same string instead
+    # of re-slicing the full contract (contract_excerpt is a no-op on it)
+    return analyze(
+        contract_text=contract_excerpt(contract_text),
         agreement_type=agreement_type,
         user_role=user_role,
         risk_tolerance=risk_tolerance,
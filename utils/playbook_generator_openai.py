@@ -0,0 +1,264 @@
+"""
+AI-powered playbook generation using the OpenAI API.
+
+Used when AI_PROVIDER is "openai" (the default when no Anthropic key is set).
+Sends the same prompts as the Claude backend and builds the same playbook
+structure, so the rest of the app doesn't depend on the provider.
+"""
+import hashlib
+import json
+import time
+from functools import lru_cache
+
+from openai import OpenAI
+
+import config
+from utils.playbook_common import (
+    BATCH_POLL_INTERVAL, DEFAULT_TOPIC_MAX_TOKENS, OVERVIEW_TOOL, SYSTEM_PROMPT, TOPIC_MAX_TOKENS, TOPIC_TOOL,
+    TOPICS_TO_ANALYZE, analyze_concurrently, build_playbook, contract_excerpt, extract_json, overview_or_default,
+    overview_prompt, topic_prompt
+)
+
+
+@lru_cache(maxsize=1)
+def get_openai_client():
+    """Get OpenAI client with API key from config, shared like get_anthropic_client."""
+    api_key = config.OPENAI_API_KEY
+    if not api_key:
+        raise ValueError(
+            "OpenAI API key not found. Please set the OPENAI_API_KEY environment variable."
+        )
+    # The SDK retries rate limits, server errors and timeouts with backoff
+    return OpenAI(api_key=api_key, max_retries=config.AI_MAX_RETRIES)
+
+
+def _strict_schema(schema: dict) -> dict:
+    """
+    Copy a JSON schema into the form OpenAI's strict structured outputs
+    require: every object closed, with all of its properties required.
+    """
+    if schema.get("type") == "object":
+        properties = {name: _strict_schema(prop) for name, prop in schema["properties"].items()}
+        return {**schema, "properties": properties, "required": list(properties), "additionalProperties": False}
+    if schema.get("type") == "array":
+        return {**schema, "items": _strict_schema(schema["items"])}
+    return schema
+
+
+# Structured-output formats built from the shared schemas (the prompts refer
+# to them by name). Responses are guaranteed to match the schema.
+OVERVIEW_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": OVERVIEW_TOOL["name"], "schema": _strict_schema(OVERVIEW_TOOL["input_schema"]), "strict": True
+    }
+}
+TOPIC_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": TOPIC_TOOL["name"], "schema": _strict_schema(TOPIC_TOOL["input_schema"]), "strict": True
+    }
+}
+
+
+def _completion_params(contract_text: str, prompt: str, max_tokens: int, response_format: dict) -> dict:
+    """
+    Build the chat.completions.create parameters for one analysis prompt.
+
+    The system prompt and contract come first and the per-request
+    instructions last, so all of a contract's requests share one long prefix
+    for OpenAI's automatic prompt caching. prompt_cache_key routes them to
+    the same cache.
+    """
+    contract = contract_excerpt(contract_text)
+    return {
+        "model": config.OPENAI_MODEL,
+        "max_tokens": max_tokens,
+        "response_format": response_format,
+        "prompt_cache_key": hashlib.sha256(contract.encode()).hexdigest()[:32],
+        "messages": [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": f"CONTRACT TEXT:\n{contract}\n\n{prompt}"}
+        ]
+    }
+
+
+def _overview_params(contract_text: str, agreement_type: str, user_role: str, risk_tolerance: str) -> dict:
+    """Build the request parameters for the agreement overview."""
+    return _completion_params(
+        contract_text, overview_prompt(agreement_type, user_role, risk_tolerance), 4096, OVERVIEW_FORMAT
+    )
+
+
+def _topic_params(
+    topic_name: str,
+    topic_description: str,
+    contract_text: str,
+    agreement_type: str,
+    user_role: str,
+    risk_tolerance: str
+) -> dict:
+    """Build the request parameters for one contract topic."""
+    return _completion_params(
+        contract_text,
+        topic_prompt(topic_name, topic_description, agreement_type, user_role, risk_tolerance),
+        TOPIC_MAX_TOKENS.get(topic_name, DEFAULT_TOPIC_MAX_TOKENS),
+        TOPIC_FORMAT
+    )
+
+
+def _complete(client: OpenAI, params: dict):
+    """Run one analysis request. Returns the parsed JSON, or None (e.g. on a refusal)."""
+    # prompt_cache_key goes through extra_body: SDK releases older than the
+    # parameter (still allowed by requirements.txt) reject it as a keyword
+    params = dict(params)
+    extra_body = {"prompt_cache_key": params.pop("prompt_cache_key")}
+    response = client.chat.completions.create(**params, extra_body=extra_body)
+    return extract_json(response.choices[0].message.content or "")
+
+
+def analyze_contract_with_openai(
+    contract_text: str,
+    agreement_type: str = "General Agreement",
+    user_role: str = "Customer",
+    risk_tolerance: str = "Moderate",
+    progress_callback=None
+) -> dict:
+    """
+    Analyze contract using the OpenAI API with topic-based organization.
+
+    Returns a structured playbook matching the format of professional legal playbooks.
+    """
+    client = get_openai_client()
+
+    if progress_callback:
+        progress_callback(5, "Preparing contract analysis...")
+
+    if progress_callback:
+        progress_callback(10, "Analyzing agreement structure...")
+
+    overview, topic_results = analyze_concurrently(
+        lambda: overview_or_default(
+            _complete(client, _overview_params(contract_text, agreement_type, user_role, risk_tolerance)),
+            agreement_type
+        ),
+        lambda topic_name, topic_description: _complete(
+            client,
+            _topic_params(topic_name, topic_description, contract_text, agreement_type, user_role, risk_tolerance)
+        ),
+        progress_callback
+    )
+
+    if progress_callback:
+        progress_callback(90, "Compiling playbook...")
+
+    playbook = build_playbook(overview, topic_results, agreement_type, user_role)
+
+    if progress_callback:
+        progress_callback(100, "Analysis complete")
+
+    return playbook
+
+
+def analyze_contract_batched(
+    contract_text: str,
+    agreement_type: str = "General Agreement",
+    user_role: str = "Customer",
+    risk_tolerance: str = "Moderate",
+    progress_callback=None
+) -> dict:
+    """
+    Analyze contract through the OpenAI Batch API.
+
+    Same requests and output as analyze_contract_with_openai, uploaded as one
+    JSONL batch at half the token price and against a separate rate limit.
+    Batches can take up to 24 hours, so this is only used when AI_BATCH=1.
+    """
+    client = get_openai_client()
+
+    if progress_callback:
+        progress_callback(5, "Submitting analysis batch...")
+
+    requests = [{
+        "custom_id": "overview",
+        "method": "POST",
+        "url": "/v1/chat/completions",
+        "body": _overview_params(contract_text, agreement_type, user_role, risk_tolerance)
+    }]
+    for idx, (topic_name, topic_description) in enumerate(TOPICS_TO_ANALYZE):
+        requests.append({
+            "custom_id": f"topic-{idx}",
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": _topic_params(
+                topic_name, topic_description, contract_text, agreement_type, user_role, risk_tolerance
+            )
+        })
+
+    batch_input = "\n".join(json.dumps(request) for request in requests).encode("utf-8")
+    input_file = client.files.create(file=("playbook_batch.jsonl", batch_input), purpose="batch")
+    batch = None
+    try:
+        batch = client.batches.create(
+            input_file_id=input_file.id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h"
+        )
+
+        while batch.status not in ("completed", "failed", "expired", "cancelled"):
+            time.sleep(BATCH_POLL_INTERVAL)
+            batch = client.batches.retrieve(batch.id)
+            if progress_callback and batch.request_counts:
+                done = batch.request_counts.completed + batch.request_counts.failed
+                progress_callback(
+                    10 + int((done / len(requests)) * 75),
+                    f"Waiting for batch analysis ({done}/{len(requests)} requests done)..."
+                )
+
+        if not batch.output_file_id:
+            raise RuntimeError(f"OpenAI batch {batch.id} {batch.status} without results")
+        output = client.files.content(batch.output_file_id).text
+    finally:
+        # The batch files hold the contract text and its analysis, so none
+        # of them are left stored once the results have been read
+        file_ids = [input_file.id]
+        if batch is not None:
+            file_ids += [batch.output_file_id, batch.error_file_id]
+        for file_id in filter(None, file_ids):
+            try:
+                client.files.delete(file_id)
+            except Exception as e:
+                print(f"Error deleting batch file {file_id}: {e}")
+
+    overview = overview_or_default(None, agreement_type)
+    topic_results = {}
+    for line in output.splitlines():
+        entry = json.loads(line)
+        if entry["custom_id"] == "overview":
+            name = "overview"
+        else:
+            name = TOPICS_TO_ANALYZE[int(entry["custom_id"].split("-", 1)[1])][0]
+
+        response = entry.get("response")
+        if not response or response.get("status_code") != 200:
+            print(f"Error analyzing {name}: batch request failed: {entry.get('error')}")
+            continue
+
+        try:
+            result = extract_json(response["body"]["choices"][0]["message"]["content"] or "")
+            if name == "overview":
+                overview = overview_or_default(result, agreement_type)
+            else:
+                topic_results[name] = result
+        except Exception as e:
+            print(f"Error analyzing {name}: {e}")
+
+    if progress_callback:
+        progress_callback(90, "Compiling playbook...")
+
+    playbook = build_playbook(overview, topic_results, agreement_type, user_role)
+
+    if progress_callback:
+        progress_callback(100, "Analysis complete")
+
+    return playbook